@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    """Допуск дорогих AI запросов: лимит на чат и общий лимит вызовов Gemini
+
+    У каждого чата свой token bucket (chat_rate запросов в секунду, запас
+    chat_burst). Одновременно к Gemini идут не больше max_concurrent
+    вызовов, остальные ждут в справедливой очереди: освободившийся вызов
+    достается следующему чату по кругу, поэтому чат с десятком запросов
+    не задерживает остальных. Запрос без токена, при полной очереди или
+    после wait_timeout ожидания не допускается - вызывающий код отвечает
+    сохраненным или резервным текстом.
+
+    Все методы вызываются из одного event loop.
+    """
+
+    def __init__(self, chat_rate=0.2, chat_burst=5, max_concurrent=20, max_waiting=500,
+                 wait_timeout=3, max_chats=100000):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.max_chats = max_chats
+        self.chat_buckets = {}
+        self.in_flight = 0
+        # chat_id -> ожидающие future; ring - чаты с ожидающими в порядке обхода
+        self.waiting = {}
+        self.ring = deque()
+        self.waiting_count = 0
+        self.stats = {'admitted': 0, 'queued': 0, 'rate_limited': 0, 'overloaded': 0, 'timed_out': 0}
+
+    def allow(self, chat_id):
+        """Забирает токен чата; False - чат исчерпал свой лимит"""
+        now = time.monotonic()
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.max_chats:
+                TokenBucket.prune(self.chat_buckets, now)
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        if bucket.take(now):
+            return True
+        self.stats['rate_limited'] += 1
+        return False
+
+    async def acquire(self, chat_id):
+        """Ждет своей очереди на вызов Gemini; False - вызов не допущен
+
+        После True обязательно вызвать release().
+        """
+        if self.in_flight < self.max_concurrent and not self.ring:
+            self.in_flight += 1
+            self.stats['admitted'] += 1
+            return True
+        if self.waiting_count >= self.max_waiting:
+            self.stats['overloaded'] += 1
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self.waiting.get(chat_id)
+        if queue is None:
+            queue = self.waiting[chat_id] = deque()
+            self.ring.append(chat_id)
+        queue.append(future)
+        self.waiting_count += 1
+        self.stats['queued'] += 1
+        try:
+            await asyncio.wait_for(future, self.wait_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self._forget(chat_id, future)
+            self.stats['timed_out'] += 1
+            return False
+        except asyncio.CancelledError:
+            self._forget(chat_id, future)
+            raise
+
+    def _forget(self, chat_id, future):
+        if future.done() and not future.cancelled():
+            # Вызов уже передан этому запросу, но ждать его некому
+            self.release()
+            return
+        queue = self.waiting.get(chat_id)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self.waiting_count -= 1
+        if not queue:
+            del self.waiting[chat_id]
+            self.ring.remove(chat_id)
+
+    def release(self):
+        """Вызов Gemini завершен: место переходит следующему чату по кругу"""
+        while self.ring:
+            chat_id = self.ring.popleft()
+            queue = self.waiting[chat_id]
+            future = queue.popleft()
+            self.waiting_count -= 1
+            if queue:
+                self.ring.append(chat_id)
+            else:
+                del self.waiting[chat_id]
+            if not future.done():
+                future.set_result(None)
+                self.stats['admitted'] += 1
+                return
+        self.in_flight -= 1
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['in_flight'] = self.in_flight
+        stats['waiting'] = self.waiting_count
+        stats['chats_waiting'] = len(self.waiting)
+        stats['chats_tracked'] = len(self.chat_buckets)
+        return stats
@@ -0,0 +1,128 @@
+"""ASGI режим: все обработчики выполняются в одном event loop сервера
+
+Запуск: uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import json
+import logging
+
+from telegram import Update
+
+import bot as astro
+from update_queue import AsyncUpdateWorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+async def send_response(send, body, status=200, content_type='text/plain; charset=utf-8'):
+    """Отправка HTTP ответа"""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive):
+    """Чтение тела запроса"""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def lifespan(receive, send):
+    """Запуск пула воркеров и слив очереди при остановке"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if astro.UPDATE_WORKERS > 0:
+                astro.update_pool = AsyncUpdateWorkerPool(
+                    astro.process_update,
+                    workers=astro.UPDATE_WORKERS,
+                    maxsize=astro.UPDATE_QUEUE_SIZE
+                )
+                astro.update_pool.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if astro.update_pool:
+                await astro.update_pool.stop(astro.SHUTDOWN_DRAIN_TIMEOUT)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def webhook(receive, send):
+    """Обработка входящих обновлений
+
+    Ответ отправляется один раз после try: ошибка отправки (клиент
+    отключился) не должна приводить ко второму http.response.start.
+    """
+    body, status = 'ok', 200
+    try:
+        json_data = json.loads(await read_body(receive))
+        update = Update.de_json(json_data, astro.bot)
+
+        if astro.seen_updates and astro.seen_updates.check_and_add(update.update_id):
+            logger.info(f"Duplicate update {update.update_id} ignored")
+        elif astro.update_pool:
+            if not astro.update_pool.submit(update, key=update.effective_chat.id if update.effective_chat else None):
+                logger.warning(f"Update queue full, rejecting update {update.update_id}")
+                if astro.seen_updates:
+                    astro.seen_updates.discard(update.update_id)
+                body, status = 'busy', 503
+        else:
+            await astro.process_update(update)
+    except Exception as e:
+        astro.count_error('webhook', e)
+        logger.error(f"Error: {e}")
+    await send_response(send, body, status=status)
+
+
+async def set_webhook(send):
+    """Установка webhook"""
+    try:
+        if astro.WEBHOOK_URL:
+            webhook_url = f"{astro.WEBHOOK_URL}/{astro.TOKEN}"
+            await astro.admin_bot.set_webhook(url=webhook_url)
+            logger.info(f"Webhook set to {webhook_url}")
+            body = f'Webhook set to {webhook_url}'
+        else:
+            body = 'WEBHOOK_URL not set'
+    except Exception as e:
+        logger.error(f'Error setting webhook: {e}')
+        body = f'Error: {e}'
+    await send_response(send, body)
+
+
+async def app(scope, receive, send):
+    """ASGI приложение с теми же маршрутами, что и Flask app"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    path = scope['path']
+    method = scope['method']
+
+    if path == f'/{astro.TOKEN}' and method == 'POST':
+        await webhook(receive, send)
+    elif path == '/':
+        await send_response(send, 'AstroHarmony Bot is running! 🌟')
+    elif path == '/health':
+        await send_response(send, 'OK')
+    elif path == '/metrics':
+        # Сбор метрик читает sqlite хранилища - не в event loop
+        body = await asyncio.to_thread(astro.metrics.render)
+        await send_response(send, body, content_type='text/plain; version=0.0.4')
+    elif path == '/stats':
+        stats = await asyncio.to_thread(astro.get_stats)
+        await send_response(send, json.dumps(stats), content_type='application/json')
+    elif path == '/set_webhook':
+        await set_webhook(send)
+    else:
+        await send_response(send, 'Not Found', status=404)
@@ -0,0 +1,138 @@
+"""Заранее вычисленные таблицы знаков, чисел пути и совместимости
+
+Все таблицы строятся один раз при импорте; функции только индексируют их.
+Результаты совпадают с прежними вычислениями, в том числе для
+некорректных дат вроде 31.02 (проверку дат делает вызывающий код).
+"""
+
+ZODIAC_SIGNS = (
+    "♈ Овен", "♉ Телец", "♊ Близнецы", "♋ Рак", "♌ Лев", "♍ Дева",
+    "♎ Весы", "♏ Скорпион", "♐ Стрелец", "♑ Козерог", "♒ Водолей", "♓ Рыбы"
+)
+LIFE_PATH_NUMBERS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 22, 33)
+MASTER_NUMBERS = (11, 22, 33)
+
+# Первый день каждого знака (месяц, день) в порядке ZODIAC_SIGNS
+SIGN_STARTS = (
+    (3, 21), (4, 20), (5, 21), (6, 21), (7, 23), (8, 23),
+    (9, 23), (10, 23), (11, 22), (12, 22), (1, 20), (2, 19)
+)
+
+# Номер первого дня месяца в високосном году - в таблице есть 29.02
+MONTH_OFFSETS = (0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335)
+
+
+def day_of_year(day, month):
+    """Индекс дня в SIGN_BY_DAY; день вне 1..31 приводится к границе"""
+    return MONTH_OFFSETS[month - 1] + min(max(day, 1), 31) - 1
+
+
+def _build_sign_by_day():
+    signs = [None] * 366
+    for index, (month, day) in enumerate(SIGN_STARTS):
+        next_month, next_day = SIGN_STARTS[(index + 1) % 12]
+        start = day_of_year(day, month)
+        end = day_of_year(next_day, next_month)
+        position = start
+        while position != end:
+            signs[position] = ZODIAC_SIGNS[index]
+            position = (position + 1) % 366
+    return tuple(signs)
+
+
+SIGN_BY_DAY = _build_sign_by_day()
+
+
+def get_zodiac_sign(day, month):
+    """Определяет знак зодиака по дате"""
+    if 1 <= month <= 12:
+        if 1 <= day <= 31:
+            return SIGN_BY_DAY[MONTH_OFFSETS[month - 1] + day - 1]
+        return SIGN_BY_DAY[day_of_year(day, month)]
+    return ZODIAC_SIGNS[-1]
+
+
+# Сумма цифр для чисел до 9999 (день, месяц, год)
+DIGIT_SUMS = bytes(
+    a + b + c + d for a in range(10) for b in range(10) for c in range(10) for d in range(10)
+)
+
+
+def _reduce(total):
+    while total > 9 and total not in MASTER_NUMBERS:
+        total = sum(int(d) for d in str(total))
+    return total
+
+
+# Число пути по сумме всех цифр даты (не больше 9+9+36)
+LIFE_PATH_BY_SUM = bytes(_reduce(total) for total in range(3 * 36 + 1))
+
+
+def get_life_path_number(day, month, year):
+    """Вычисляет число жизненного пути"""
+    if 0 <= day < 10000 and 0 <= month < 10000 and 0 <= year < 10000:
+        return LIFE_PATH_BY_SUM[DIGIT_SUMS[day] + DIGIT_SUMS[month] + DIGIT_SUMS[year]]
+    return _reduce(sum(int(d) for d in str(day) + str(month) + str(year)))
+
+
+COMPATIBILITY_SCORES = {
+    ('♈', '♌'): 95, ('♈', '♐'): 90, ('♈', '♊'): 85,
+    ('♉', '♍'): 95, ('♉', '♑'): 90, ('♉', '♋'): 85,
+    ('♊', '♎'): 95, ('♊', '♒'): 90, ('♊', '♈'): 85,
+    ('♋', '♏'): 95, ('♋', '♓'): 90, ('♋', '♉'): 85,
+    ('♌', '♈'): 95, ('♌', '♐'): 90, ('♌', '♊'): 85,
+    ('♍', '♉'): 95, ('♍', '♑'): 90, ('♍', '♏'): 85,
+    ('♎', '♊'): 95, ('♎', '♒'): 90, ('♎', '♐'): 85,
+    ('♏', '♋'): 95, ('♏', '♓'): 90, ('♏', '♑'): 85,
+    ('♐', '♈'): 90, ('♐', '♌'): 90, ('♐', '♎'): 85,
+    ('♑', '♉'): 90, ('♑', '♍'): 90, ('♑', '♏'): 85,
+    ('♒', '♊'): 90, ('♒', '♎'): 90, ('♒', '♐'): 85,
+    ('♓', '♋'): 90, ('♓', '♏'): 90, ('♓', '♉'): 85,
+}
+DEFAULT_SCORE = 70
+
+
+def compatibility_level(score):
+    """(оценка, уровень, эмодзи) для оценки совместимости"""
+    if score >= 90:
+        return score, "Отличная", "💚💚💚"
+    if score >= 80:
+        return score, "Хорошая", "💚💚"
+    if score >= 70:
+        return score, "Средняя", "💛"
+    return score, "Низкая", "🧡"
+
+
+# Порядковый номер знака по полному названию и по символу
+SIGN_INDEX = {}
+for _index, _sign in enumerate(ZODIAC_SIGNS):
+    SIGN_INDEX[_sign] = _index
+    SIGN_INDEX[_sign.split()[0]] = _index
+
+# Матрица 12x12 с готовыми (оценка, уровень, эмодзи)
+COMPATIBILITY = tuple(
+    tuple(
+        compatibility_level(
+            COMPATIBILITY_SCORES.get((s1.split()[0], s2.split()[0]))
+            or COMPATIBILITY_SCORES.get((s2.split()[0], s1.split()[0]))
+            or DEFAULT_SCORE
+        )
+        for s2 in ZODIAC_SIGNS
+    )
+    for s1 in ZODIAC_SIGNS
+)
+UNKNOWN_COMPATIBILITY = compatibility_level(DEFAULT_SCORE)
+
+
+def get_compatibility(sign1, sign2):
+    """Определяет совместимость двух знаков"""
+    # Как и раньше, знак определяется по символу перед пробелом
+    index1 = SIGN_INDEX.get(sign1)
+    if index1 is None:
+        index1 = SIGN_INDEX.get(sign1.split()[0])
+    index2 = SIGN_INDEX.get(sign2)
+    if index2 is None:
+        index2 = SIGN_INDEX.get(sign2.split()[0])
+    if index1 is None or index2 is None:
+        return UNKNOWN_COMPATIBILITY
+    return COMPATIBILITY[index1][index2]
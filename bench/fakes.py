@@ -0,0 +1,176 @@
+"""Локальные заглушки Telegram Bot API и Gemini для бенчмарков"""
+import asyncio
+import json
+import queue
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeTelegramServer:
+    """HTTP сервер, отвечающий как Bot API и запоминающий исходящие сообщения
+
+    Для каждого чата есть очередь (время получения, метод, параметры) -
+    генератор нагрузки ждет в ней ответ бота. Входящие обновления для
+    getUpdates добавляются через push_update().
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.replies = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.updates = []
+        self.updates_ready = threading.Condition()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def replies_for(self, chat_id):
+        with self.lock:
+            if chat_id not in self.replies:
+                self.replies[chat_id] = queue.Queue()
+            return self.replies[chat_id]
+
+    def push_update(self, update):
+        """Обновление, которое бот получит через getUpdates"""
+        with self.updates_ready:
+            self.updates.append(update)
+            self.updates_ready.notify_all()
+
+    def get_updates(self, offset, limit, timeout):
+        """Как в Bot API: обновления с id < offset считаются подтвержденными"""
+        with self.updates_ready:
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            self.updates_ready.wait_for(lambda: self.updates, timeout)
+            return self.updates[:limit]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-telegram', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                method = self.path.rsplit('/', 1)[-1]
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body or b'{}')
+                else:
+                    params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+                with fake.lock:
+                    fake.calls += 1
+                if method == 'getUpdates':
+                    updates = fake.get_updates(
+                        int(params.get('offset') or 0), int(params.get('limit') or 100),
+                        float(params.get('timeout') or 0)
+                    )
+                    return self._reply(200, {'ok': True, 'result': updates})
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.failure_rate and random.random() < fake.failure_rate:
+                    return self._reply(500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+                result = True
+                if 'chat_id' in params:
+                    chat_id = int(params['chat_id'])
+                    result = {
+                        'message_id': random.randint(1, 1 << 30),
+                        'date': int(time.time()),
+                        'chat': {'id': chat_id, 'type': 'private'},
+                        'text': params.get('text', ''),
+                    }
+                    fake.replies_for(chat_id).put((time.monotonic(), method, params))
+                elif method == 'getMe':
+                    result = {'id': 1, 'is_bot': True, 'first_name': 'AstroHarmony', 'username': 'astro_bot'}
+                self._reply(200, {'ok': True, 'result': result})
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStreamResponse:
+    """Потоковый ответ: фрагменты текста с равномерной задержкой между ними"""
+
+    def __init__(self, chunks, delay):
+        self.chunks = chunks
+        self.delay = delay
+
+    async def __aiter__(self):
+        for index, chunk in enumerate(self.chunks):
+            if index:
+                await asyncio.sleep(self.delay)
+            yield FakeResponse(chunk)
+
+
+class FakeGeminiModel:
+    """Замена genai.GenerativeModel с заданной задержкой и долей ошибок
+
+    С stream=True первый фрагмент приходит через 1/N полной задержки,
+    остальные - равномерно за оставшееся время.
+    """
+
+    TEXT = (
+        'Сегодня звезды на вашей стороне! ✨ Используйте этот день для новых начинаний. '
+        'Доверяйте интуиции и не бойтесь перемен! 🌟 Вас ждет приятный сюрприз. '
+    )
+
+    def __init__(self, latency=1.0, jitter=0.2, failure_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.calls = 0
+
+    def _delay(self):
+        return max(self.latency + random.uniform(-self.jitter, self.jitter), 0)
+
+    def _result(self):
+        self.calls += 1
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError('fake Gemini failure')
+        return FakeResponse(self.TEXT * 3)
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self._delay())
+        return self._result()
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        if not stream:
+            await asyncio.sleep(self._delay())
+            return self._result()
+        text = self._result().text
+        chunks = [text[i:i + 40] for i in range(0, len(text), 40)]
+        delay = self._delay() / len(chunks)
+        await asyncio.sleep(delay)
+        return FakeStreamResponse(chunks, delay)
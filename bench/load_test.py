@@ -0,0 +1,269 @@
+"""Нагрузочный тест бота с локальными заглушками Telegram и Gemini
+
+Запуск:
+    python bench/load_test.py --mode flask --users 50 --iterations 20
+    python bench/load_test.py --mode asgi --gemini-latency 2 --gemini-failure-rate 0.1 --json
+    python bench/load_test.py --mode polling --users 200
+
+Каждый виртуальный пользователь проходит сценарии со всеми командами
+process_message и всеми callback кнопками webhook(). Для каждого шага
+измеряется время ответа webhook и время до получения ответа бота
+заглушкой Telegram. В режиме polling обновления отдаются боту через
+getUpdates заглушки, время webhook в отчете - время постановки в очередь. Настройки бота задаются обычными переменными окружения.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeGeminiModel, FakeTelegramServer  # noqa: E402
+
+TOKEN = '123456:BENCHMARK'
+
+
+def random_date():
+    return f'{random.randint(1, 28):02d}.{random.randint(1, 12):02d}.{random.randint(1950, 2010)}'
+
+
+def random_pair():
+    return f'{random_date()} и {random_date()}'
+
+
+# Сценарий - последовательность шагов: ('text', сообщение) или ('callback', data)
+SCENARIOS = [
+    [('text', '/start')],
+    [('text', '/help')],
+    [('text', '/tarot')],
+    [('text', '/premium')],
+    [('text', '/feedback')],
+    [('text', 'привет')],
+    [('text', '/compatibility'), ('text', random_pair)],
+    [('text', '/synastry'), ('text', random_pair)],
+    [('text', '/numerology'), ('text', random_date)],
+    [('text', '/astrology'), ('text', random_date)],
+    [('text', '/life_path'), ('text', random_date)],
+    [('text', '/profile'), ('text', random_date)],
+    [('callback', 'compatibility'), ('text', random_pair)],
+    [('callback', 'numerology'), ('text', random_date)],
+    [('callback', 'astrology'), ('text', random_date)],
+    [('callback', 'premium')],
+]
+
+
+def make_update(update_id, chat_id, kind, value):
+    chat = {'id': chat_id, 'type': 'private'}
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'}
+    if kind == 'text':
+        return {
+            'update_id': update_id,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': value},
+        }
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id), 'from': user, 'chat_instance': str(chat_id), 'data': value,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'text': 'menu'},
+        },
+    }
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 1),
+        'p95_ms': round(percentile(values, 95) * 1000, 1),
+        'p99_ms': round(percentile(values, 99) * 1000, 1),
+        'max_ms': round(max(values) * 1000, 1) if values else 0.0,
+    }
+
+
+def start_server(mode, port):
+    """Запускает Flask app, ASGI app или polling в фоновом потоке"""
+    if mode == 'polling':
+        import polling
+        started = threading.Event()
+        state = {}
+
+        async def serve():
+            state['loop'] = asyncio.get_running_loop()
+            state['stopping'] = asyncio.Event()
+            started.set()
+            await polling.run_polling(state['stopping'], timeout=10)
+
+        thread = threading.Thread(target=asyncio.run, args=(serve(),), daemon=True)
+        thread.start()
+        started.wait()
+
+        def stop():
+            state['loop'].call_soon_threadsafe(state['stopping'].set)
+            thread.join(30)
+        return stop
+    if mode == 'flask':
+        from werkzeug.serving import make_server
+        import bot as astro
+        server = make_server('127.0.0.1', port, astro.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server.shutdown
+    import uvicorn
+    import asgi
+    config = uvicorn.Config(asgi.app, host='127.0.0.1', port=port, log_level='warning', lifespan='on')
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join(30)
+    return stop
+
+
+def run_load(base_url, telegram, users, iterations, timeout, polling=False):
+    """Виртуальные пользователи проходят случайные сценарии"""
+    import httpx
+
+    webhook_times = []
+    reply_times = []
+    errors = {'http': 0, 'timeout': 0}
+    lock = threading.Lock()
+    update_ids = iter(range(1, 1 << 62))
+
+    def user(index):
+        client = httpx.Client(base_url=base_url, timeout=timeout)
+        for iteration in range(iterations):
+            # Новый чат на каждую итерацию - сценарии не мешают друг другу
+            chat_id = 10_000_000 + iteration * users + index
+            replies = telegram.replies_for(chat_id)
+            for kind, value in random.choice(SCENARIOS):
+                if callable(value):
+                    value = value()
+                with lock:
+                    update_id = next(update_ids)
+                started = time.monotonic()
+                if polling:
+                    telegram.push_update(make_update(update_id, chat_id, kind, value))
+                    ok = True
+                else:
+                    try:
+                        response = client.post(f'/{TOKEN}', json=make_update(update_id, chat_id, kind, value))
+                        ok = response.status_code == 200
+                    except httpx.HTTPError:
+                        ok = False
+                acked = time.monotonic()
+                if not ok:
+                    with lock:
+                        errors['http'] += 1
+                    break
+                try:
+                    # Правки потокового ответа - не новый ответ
+                    received_at, method, _ = replies.get(timeout=timeout)
+                    while method == 'editMessageText':
+                        received_at, method, _ = replies.get(timeout=timeout)
+                except Exception:
+                    with lock:
+                        errors['timeout'] += 1
+                    break
+                with lock:
+                    webhook_times.append(acked - started)
+                    reply_times.append(received_at - started)
+        client.close()
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(user, range(users)))
+    return time.monotonic() - started, webhook_times, reply_times, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test for the bot')
+    parser.add_argument('--mode', choices=['flask', 'asgi', 'polling'], default='flask')
+    parser.add_argument('--users', type=int, default=20, help='concurrent virtual users')
+    parser.add_argument('--iterations', type=int, default=10, help='scenarios per user')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a reply')
+    parser.add_argument('--gemini-latency', type=float, default=1.0)
+    parser.add_argument('--gemini-jitter', type=float, default=0.2)
+    parser.add_argument('--gemini-failure-rate', type=float, default=0.0)
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--telegram-failure-rate', type=float, default=0.0)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    telegram = FakeTelegramServer(latency=args.telegram_latency, failure_rate=args.telegram_failure_rate).start()
+
+    # Окружение бота: заглушки вместо внешних сервисов, временные базы.
+    # Лимиты Telegram по умолчанию сняты, чтобы мерить сам бот.
+    workdir = tempfile.mkdtemp(prefix='astro-bench-')
+    os.environ['TELEGRAM_BOT_TOKEN'] = TOKEN
+    os.environ['TELEGRAM_API_URL'] = telegram.url
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+    os.environ.setdefault('CORPUS_DIR', '')
+    os.environ.setdefault('SUBSCRIBERS_DB', os.path.join(workdir, 'subscribers.db'))
+    os.environ.setdefault('STATE_DB_PATH', os.path.join(workdir, 'state.db'))
+    os.environ.setdefault('SEND_GLOBAL_RATE', '100000')
+    os.environ.setdefault('SEND_CHAT_RATE', '1000')
+    os.environ.setdefault('AI_CHAT_RATE', '1000')
+    os.environ.setdefault('GEMINI_MAX_CONCURRENT', '10000')
+    os.environ.setdefault('GEMINI_INIT', 'lazy')
+
+    import bot as astro
+    gemini = FakeGeminiModel(args.gemini_latency, args.gemini_jitter, args.gemini_failure_rate)
+    astro.model = gemini
+    astro.GEMINI_AVAILABLE = True
+
+    stop = start_server(args.mode, args.port)
+    try:
+        elapsed, webhook_times, reply_times, errors = run_load(
+            f'http://127.0.0.1:{args.port}', telegram, args.users, args.iterations, args.timeout,
+            polling=args.mode == 'polling'
+        )
+    finally:
+        stop()
+        telegram.stop()
+
+    report = {
+        'mode': args.mode,
+        'users': args.users,
+        'steps': len(reply_times),
+        'elapsed_s': round(elapsed, 2),
+        'requests_per_s': round(len(reply_times) / elapsed, 1) if elapsed else 0.0,
+        'webhook': summarize(webhook_times),
+        'reply': summarize(reply_times),
+        'errors': errors,
+        'gemini_calls': gemini.calls,
+        'telegram_calls': telegram.calls,
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'bot_stats': astro.get_stats(),
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"mode={report['mode']} users={report['users']} steps={report['steps']} "
+          f"elapsed={report['elapsed_s']}s rps={report['requests_per_s']}")
+    for name in ('webhook', 'reply'):
+        s = report[name]
+        print(f"{name:8} p50={s['p50_ms']}ms p95={s['p95_ms']}ms p99={s['p99_ms']}ms max={s['max_ms']}ms")
+    print(f"errors={errors} gemini_calls={gemini.calls} telegram_calls={telegram.calls} "
+          f"max_rss={report['max_rss_mb']}MB")
+
+
+if __name__ == '__main__':
+    main()
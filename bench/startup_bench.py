@@ -0,0 +1,168 @@
+"""Время холодного запуска: импорт bot.py, первый ответ и готовность Gemini
+
+Запуск:
+    python bench/startup_bench.py --runs 5
+    python bench/startup_bench.py --modes background lazy --importtime --json
+
+Каждый замер - отдельный процесс python, то есть действительно холодный
+запуск. Для каждого значения GEMINI_INIT измеряются:
+    process  - от запуска интерпретатора до выхода замеряющего процесса
+    import   - import bot
+    first    - первый /start через webhook до получения ответа заглушкой
+               Telegram (отсчитывается от начала импорта)
+    gemini   - когда get_model() вернул клиент (тоже от начала импорта)
+С --importtime дополнительно выводятся самые долгие прямые импорты
+bot.py по данным python -X importtime (при GEMINI_INIT=eager, когда все
+импорты выполняются в основном потоке).
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+TOKEN = '123456:BENCHMARK'
+CHAT_ID = 1001
+MODES = ('eager', 'background', 'lazy')
+
+# Строка вывода -X importtime: "import time: self | cumulative | имя модуля"
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def measure():
+    """Один холодный запуск; вызывается в дочернем процессе, печатает JSON"""
+    from fakes import FakeTelegramServer
+    from load_test import make_update
+
+    telegram = FakeTelegramServer().start()
+    os.environ['TELEGRAM_API_URL'] = telegram.url
+
+    started = time.perf_counter()
+    import bot as astro
+    imported = time.perf_counter()
+
+    client = astro.app.test_client()
+    response = client.post(f'/{TOKEN}', json=make_update(1, CHAT_ID, 'text', '/start'))
+    telegram.replies_for(CHAT_ID).get(timeout=30)
+    replied = time.perf_counter()
+
+    astro.get_model()
+    gemini_ready = time.perf_counter()
+    telegram.stop()
+
+    print(json.dumps({
+        'status': response.status_code,
+        'import_ms': (imported - started) * 1000,
+        'first_ms': (replied - started) * 1000,
+        'gemini_ms': (gemini_ready - started) * 1000,
+    }))
+
+
+def child_env(mode, workdir):
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_BOT_TOKEN': TOKEN,
+        'GEMINI_INIT': mode,
+        'PYTHONDONTWRITEBYTECODE': '0',
+    })
+    env.setdefault('GEMINI_API_KEY', 'benchmark')
+    env.setdefault('CORPUS_DIR', '')
+    env.setdefault('SUBSCRIBERS_DB', os.path.join(workdir, 'subscribers.db'))
+    env.setdefault('STATE_DB_PATH', os.path.join(workdir, 'state.db'))
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    return env
+
+
+def run_child(mode, workdir, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += [os.path.abspath(__file__), '--child']
+    started = time.perf_counter()
+    result = subprocess.run(command, env=child_env(mode, workdir), capture_output=True, text=True, timeout=120)
+    elapsed = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise SystemExit(f'{mode}: child failed\n{result.stderr[-2000:]}')
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample['process_ms'] = elapsed
+    return sample, result.stderr
+
+
+def top_imports(stderr, limit):
+    """Самые долгие прямые импорты bot.py, мс
+
+    -X importtime печатает модуль после всех его импортов, отступ растет
+    на два пробела с каждым уровнем: строки уровня 1 перед строкой bot -
+    прямые импорты bot.py.
+    """
+    totals = {}
+    children = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        depth = len(match.group(3)) // 2
+        if depth == 1:
+            children.append((match.group(4).split('.')[0], int(match.group(2)) / 1000))
+        elif depth == 0:
+            if match.group(4) == 'bot':
+                for name, ms in children:
+                    totals[name] = totals.get(name, 0) + ms
+            children = []
+    return sorted(((name, round(ms, 1)) for name, ms in totals.items()), key=lambda item: -item[1])[:limit]
+
+
+def summarize(samples, key):
+    values = [sample[key] for sample in samples]
+    return {'median_ms': round(statistics.median(values), 1), 'min_ms': round(min(values), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark for the bot')
+    parser.add_argument('--runs', type=int, default=5, help='cold starts per mode')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help='GEMINI_INIT values')
+    parser.add_argument('--importtime', action='store_true', help='show the slowest imports of bot.py')
+    parser.add_argument('--top', type=int, default=8, help='imports to show with --importtime')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure()
+        return
+
+    workdir = tempfile.mkdtemp(prefix='astro-startup-')
+    # Первый запуск компилирует .pyc и прогревает файловый кеш, в отчет не входит
+    run_child(args.modes[0], workdir)
+
+    report = {}
+    for mode in args.modes:
+        samples = [run_child(mode, workdir)[0] for _ in range(args.runs)]
+        report[mode] = {key[:-3]: summarize(samples, key) for key in ('process_ms', 'import_ms', 'first_ms', 'gemini_ms')}
+    if args.importtime:
+        report['imports'] = top_imports(run_child('eager', workdir, importtime=True)[1], args.top)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"runs={args.runs} (median/min)")
+    for mode in args.modes:
+        print(f"{mode:10} " + ' '.join(
+            f"{name}={report[mode][name]['median_ms']}/{report[mode][name]['min_ms']}ms"
+            for name in ('process', 'import', 'first', 'gemini')
+        ))
+    if args.importtime:
+        print('imports of bot.py (eager):')
+        for name, ms in report['imports']:
+            print(f"  {name:28} {ms}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Микробенчмарк обрезки AI текста: прежний цикл по split('.') и truncation.py
+
+Запуск: python bench/truncate_bench.py [--number 2000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from truncation import SentenceTruncator, truncate  # noqa: E402
+
+SAMPLE = (
+    'Сегодня звезды на вашей стороне! ✨ Используйте этот день для новых начинаний. '
+    'Доверяйте интуиции и не бойтесь перемен! 🌟 Вас ждет приятный сюрприз? 💫 '
+)
+
+
+def legacy_truncate(text, max_length):
+    """Прежняя обрезка из generate_text"""
+    if len(text) > max_length:
+        sentences = text.split('.')
+        result = ""
+        for sentence in sentences:
+            if len(result + sentence + '.') <= max_length:
+                result += sentence + '.'
+            else:
+                break
+        text = result if result else text[:max_length]
+    return text
+
+
+def stream_truncate(text, max_length, chunk_size=40):
+    """Та же обрезка фрагментами, как в потоковом режиме"""
+    truncator = SentenceTruncator(max_length)
+    for start in range(0, len(text), chunk_size):
+        truncator.feed(text[start:start + chunk_size])
+        if truncator.full:
+            break
+    return truncator.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark AI reply truncation')
+    parser.add_argument('--number', type=int, default=2000, help='calls per measurement')
+    args = parser.parse_args()
+
+    cases = [
+        ('reply 3x limit', SAMPLE * 4, 200),
+        ('short limit', SAMPLE * 4, 50),
+        ('long reply', SAMPLE * 40, 1000),
+        ('huge, big limit', SAMPLE * 400, 4000),
+    ]
+    print(f"{'case':18} {'chars':>7} {'limit':>6} {'legacy us':>10} {'new us':>8} {'stream us':>10}")
+    for name, text, limit in cases:
+        row = []
+        for func in (legacy_truncate, truncate, stream_truncate):
+            seconds = timeit.timeit(lambda: func(text, limit), number=args.number)
+            row.append(seconds / args.number * 1e6)
+        print(f"{name:18} {len(text):>7} {limit:>6} {row[0]:>10.1f} {row[1]:>8.1f} {row[2]:>10.1f}")
+
+    print('\nlimit 120:')
+    print(f"  legacy: {legacy_truncate(SAMPLE * 2, 120)!r}")
+    print(f"  new:    {truncate(SAMPLE * 2, 120)!r}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Разбор и проверка дат рождения
+
+Дата принимается как ДД.ММ.ГГГГ, а также с разделителями / - или
+пробелом (один и тот же в обоих местах). Несуществующие даты (31.02),
+годы до 1900 и даты в будущем отклоняются, до Gemini они не доходят.
+Одни и те же даты приходят постоянно, поэтому результаты разбора
+кешируются.
+"""
+import re
+from collections import namedtuple
+from datetime import date
+from functools import lru_cache
+
+from astro_tables import get_life_path_number, get_zodiac_sign
+
+DATE_PATTERN = re.compile(r'(\d{1,2})([./\- ])(\d{1,2})\2(\d{4})')
+MIN_YEAR = 1900
+MAX_TEXT_LENGTH = 16
+CACHE_SIZE = 4096
+
+
+class BirthDate(namedtuple('BirthDate', 'day month year sign life_path')):
+    """Проверенная дата рождения с уже вычисленными знаком и числом пути"""
+    __slots__ = ()
+
+    def __str__(self):
+        return f'{self.day:02d}.{self.month:02d}.{self.year}'
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse(text):
+    match = DATE_PATTERN.fullmatch(text)
+    if not match:
+        return None
+    day, month, year = int(match[1]), int(match[3]), int(match[4])
+    if year < MIN_YEAR:
+        return None
+    try:
+        date(year, month, day)
+    except ValueError:
+        return None
+    return BirthDate(day, month, year, get_zodiac_sign(day, month), get_life_path_number(day, month, year))
+
+
+def parse_birth_date(text):
+    """BirthDate для текста или None, если это не существующая дата рождения"""
+    text = text.strip()
+    if len(text) > MAX_TEXT_LENGTH:
+        return None
+    birth = _parse(text)
+    # Будущее проверяется вне кеша: результат зависит от текущего дня
+    if birth is None or (birth.year, birth.month, birth.day) > date.today().timetuple()[:3]:
+        return None
+    return birth
+
+
+def get_cache_stats():
+    """Статистика кеша разбора для /stats"""
+    info = _parse.cache_info()
+    total = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'hit_rate': round(info.hits / total, 3) if total else 0.0,
+    }
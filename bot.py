@@ -1,18 +1,43 @@
 import os
 import logging
-from flask import Flask, request
-from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
-import re
+from flask import Flask, request, jsonify, Response
+from telegram import Bot, Update
 import asyncio
+import atexit
+import threading
 from functools import wraps
-import google.generativeai as genai
-from datetime import datetime
+from datetime import datetime, timedelta
 import random
+import time
+from update_queue import UpdateWorkerPool, AsyncUpdateWorkerPool
+from response_cache import create_response_cache
+from corpus_store import CorpusStore
+from content_catalog import ContentCatalog
+from singleflight import SingleFlight
+from admission import AdmissionController
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from state_store import create_state_store
+from seen_updates import create_seen_updates
+from send_queue import SendDispatcher
+from subscribers import SubscriberStore
+from telegram_request import create_request
+from metrics import Registry
+from logging_setup import setup_logging, get_stats as get_logging_stats
+from message_stream import MessageStream
+from truncation import SentenceTruncator, truncate
+from router import Router, parse_date, parse_pair
+from astro_tables import ZODIAC_SIGNS, LIFE_PATH_NUMBERS, get_compatibility
+from birth_dates import get_cache_stats as get_birth_date_stats
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+# Настройка логирования: LOG_FORMAT=json - структурированные записи,
+# LOG_QUEUE=1 - запись в stderr в фоновом потоке, LOG_SAMPLE_RATE - доля
+# сохраняемых частых INFO записей (каждое сообщение и обработчик)
+setup_logging(
+    os.getenv('LOG_FORMAT', 'text'),
+    os.getenv('LOG_QUEUE', '0') == '1',
+    os.getenv('LOG_LEVEL', 'INFO'),
+    float(os.getenv('LOG_SAMPLE_RATE', 1)),
+    int(os.getenv('LOG_QUEUE_SIZE', 10000))
 )
 logger = logging.getLogger(__name__)
 
@@ -21,79 +46,405 @@ TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 WEBHOOK_URL = os.getenv('WEBHOOK_URL')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+# Фоновая обработка обновлений (0 - обрабатывать прямо в webhook)
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 0))
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', 1000))
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', 30))
+
+# Кеш ответов Gemini (CACHE_MAX_ENTRIES=0 - без кеша)
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 2000))
+CACHE_VARIANTS = int(os.getenv('CACHE_VARIANTS', 3))
+CACHE_TTL = int(os.getenv('CACHE_TTL', 7 * 24 * 3600))
+# memory - в процессе, sqlite - файл CACHE_DB_PATH, общий для воркеров и перезапусков
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', 'cache.db')
+# Тексты, которые устаревают в полночь (прогнозы)
+DAILY_FEATURES = {'astrology'}
+
+# Тексты ответов, кнопки и резервные тексты; файл перечитывается при
+# изменении не чаще раза в CONTENT_RELOAD_INTERVAL секунд (<0 - не перечитывать)
+CONTENT_PATH = os.getenv('CONTENT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content.json'))
+CONTENT_RELOAD_INTERVAL = float(os.getenv('CONTENT_RELOAD_INTERVAL', 60))
+
+# Каталог с заранее сгенерированными текстами (pregenerate.py)
+CORPUS_DIR = os.getenv('CORPUS_DIR', 'corpus')
+
+# Бюджет времени на ответ Gemini, после него используется резервный текст
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', 8))
+# Circuit breaker: после BREAKER_FAILURES ошибок или медленных вызовов подряд
+# Gemini не вызывается BREAKER_RESET_TIMEOUT секунд
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 30))
+GEMINI_SLOW_CALL = float(os.getenv('GEMINI_SLOW_CALL', 5))
+# Потоковый ответ: сообщение отправляется с первым готовым предложением и
+# дописывается правками не чаще раза в STREAM_EDIT_INTERVAL секунд
+GEMINI_STREAM = os.getenv('GEMINI_STREAM', '0') == '1'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.0))
+
+# Допуск AI запросов (ADMISSION_CONTROL=0 - без ограничений): на чат не больше
+# AI_CHAT_RATE запросов в секунду с запасом AI_CHAT_BURST, к Gemini одновременно
+# не больше GEMINI_MAX_CONCURRENT вызовов, остальные ждут по очереди чатов не
+# дольше GEMINI_QUEUE_TIMEOUT. Не допущенный запрос получает сохраненный или
+# резервный текст
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', '1') == '1'
+AI_CHAT_RATE = float(os.getenv('AI_CHAT_RATE', 0.2))
+AI_CHAT_BURST = int(os.getenv('AI_CHAT_BURST', 5))
+GEMINI_MAX_CONCURRENT = int(os.getenv('GEMINI_MAX_CONCURRENT', 20))
+GEMINI_MAX_WAITING = int(os.getenv('GEMINI_MAX_WAITING', 500))
+GEMINI_QUEUE_TIMEOUT = float(os.getenv('GEMINI_QUEUE_TIMEOUT', 3))
+
+# Состояние диалогов: memory - в процессе, sqlite - общее для всех воркеров
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'state.db')
+STATE_TTL = int(os.getenv('STATE_TTL', 3600))
+STATE_MAX_ENTRIES = int(os.getenv('STATE_MAX_ENTRIES', 100000))
+
+# Повторные доставки одного update_id (0 - не отслеживать)
+DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', 600))
+DEDUP_MAX_ENTRIES = int(os.getenv('DEDUP_MAX_ENTRIES', 100000))
+
+# Лимиты исходящих сообщений (SEND_RATE_LIMIT=0 - отправлять сразу)
+SEND_RATE_LIMIT = os.getenv('SEND_RATE_LIMIT', '1') == '1'
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', 30))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1))
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', 3))
+SEND_MAX_PENDING = int(os.getenv('SEND_MAX_PENDING', 10000))
+SEND_CONCURRENCY = int(os.getenv('SEND_CONCURRENCY', 30))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', 3))
+
+# Пользователи с датой рождения для ежедневной рассылки (пусто - не сохранять)
+SUBSCRIBERS_DB = os.getenv('SUBSCRIBERS_DB', 'subscribers.db')
+
+# Адрес Bot API (локальный Bot API сервер или заглушка для бенчмарков)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Пул соединений к Bot API: размер не меньше SEND_CONCURRENCY,
+# TELEGRAM_HTTP_VERSION=2 требует httpx[http2]
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', 32))
+TELEGRAM_KEEPALIVE = float(os.getenv('TELEGRAM_KEEPALIVE', 30))
+TELEGRAM_HTTP_VERSION = os.getenv('TELEGRAM_HTTP_VERSION', '1.1')
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', 5))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', 5))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_WRITE_TIMEOUT', 5))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv('TELEGRAM_POOL_TIMEOUT', 5))
+# Отдельный небольшой пул для set_webhook и других служебных вызовов
+TELEGRAM_ADMIN_POOL_SIZE = int(os.getenv('TELEGRAM_ADMIN_POOL_SIZE', 1))
+
+# Когда создавать клиент Gemini: eager, background или lazy
+GEMINI_INIT = os.getenv('GEMINI_INIT', 'background')
+
 if not TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN not found")
 if not GEMINI_API_KEY:
     logger.warning("GEMINI_API_KEY not found, using fallback responses")
 
-# Настраиваем Gemini
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-pro')
-    GEMINI_AVAILABLE = True
-except:
-    GEMINI_AVAILABLE = False
-    logger.warning("Gemini not configured properly")
+# Настраиваем Gemini. Импорт google.generativeai - больше половины
+# времени запуска, поэтому клиент создается по GEMINI_INIT: eager - при
+# импорте bot.py, background - в фоновом потоке, не задерживая запуск,
+# lazy - при первом AI запросе
+model = None
+model_lock = threading.Lock()
+GEMINI_AVAILABLE = True
+
+def get_model():
+    """Клиент Gemini (None - не настроен); создается при первом вызове"""
+    global model, GEMINI_AVAILABLE
+    if model is not None or not GEMINI_AVAILABLE:
+        return model
+    with model_lock:
+        try:
+            import google.generativeai as genai
+            # Пока шел импорт, model мог быть задан снаружи (тесты, бенчмарки)
+            if model is None and GEMINI_AVAILABLE:
+                genai.configure(api_key=GEMINI_API_KEY)
+                model = genai.GenerativeModel('gemini-pro')
+        except Exception as e:
+            GEMINI_AVAILABLE = False
+            logger.warning(f"Gemini not configured properly: {e}")
+    return model
+
+# Поток фоновой инициализации; перед fork (gunicorn --preload) его нужно
+# дождаться, иначе воркер может получить захваченный model_lock
+model_thread = None
+if GEMINI_INIT == 'eager':
+    get_model()
+elif GEMINI_INIT == 'background':
+    model_thread = threading.Thread(target=get_model, name='gemini-init', daemon=True)
+    model_thread.start()
 
 # Создаем Flask приложение
 app = Flask(__name__)
 
-# Создаем единый event loop
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
+# Метрики для /metrics
+metrics = Registry()
+HANDLER_LATENCY = metrics.histogram('astro_handler_duration_seconds', 'Handler execution time', ['handler'])
+GEMINI_LATENCY = metrics.histogram('astro_gemini_duration_seconds', 'Gemini generation time', ['outcome'])
+TELEGRAM_SEND_LATENCY = metrics.histogram('astro_telegram_send_duration_seconds', 'Telegram sendMessage request time')
+AI_RESPONSES = metrics.counter('astro_ai_responses', 'AI text lookups by source (fallback - static text used)', ['feature', 'source'])
+ERRORS = metrics.counter('astro_errors', 'Errors by place and exception type', ['source', 'type'])
+
+def count_error(source, e):
+    ERRORS.labels(source=source, type=type(e).__name__).inc()
+
+def count_ai_response(feature, source):
+    """Откуда взят AI текст: corpus, cache, gemini, degraded или fallback"""
+    AI_RESPONSES.labels(feature=feature, source=source).inc()
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("AI text for %s from %s", feature, source,
+                    extra={'feature': feature, 'source': source, 'sampled': True})
+
+def track_handler(func):
+    """Декоратор: гистограмма времени выполнения обработчика и запись в лог"""
+    name = func.__name__
+    histogram = HANDLER_LATENCY.labels(handler=name)
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - started
+            histogram.observe(duration)
+            if logger.isEnabledFor(logging.INFO):
+                duration_ms = round(duration * 1000, 1)
+                logger.info("Handled %s in %sms", name, duration_ms,
+                            extra={'handler': name, 'duration_ms': duration_ms, 'sampled': True})
+    return wrapper
+
+# Единый долгоживущий event loop для синхронного (Flask) режима. Работает в
+# отдельном потоке, чтобы им могли пользоваться несколько потоков (воркеры
+# очереди, потоки gunicorn). В ASGI режиме (asgi.py) используется loop сервера.
+loop = None
+loop_lock = threading.Lock()
 
 # Создаем бота
-bot = Bot(token=TOKEN)
+def create_service_request():
+    """Небольшой пул для служебных вызовов и get_updates"""
+    return create_request(
+        TELEGRAM_ADMIN_POOL_SIZE, TELEGRAM_KEEPALIVE, '1.1',
+        TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT, TELEGRAM_WRITE_TIMEOUT, TELEGRAM_POOL_TIMEOUT
+    )
+
+# Пул для get_updates задан явно: иначе Bot создает свой HTTPXRequest со
+# своим SSL контекстом
+bot = Bot(token=TOKEN, base_url=f'{TELEGRAM_API_URL}/bot', request=create_request(
+    TELEGRAM_POOL_SIZE, TELEGRAM_KEEPALIVE, TELEGRAM_HTTP_VERSION,
+    TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT, TELEGRAM_WRITE_TIMEOUT, TELEGRAM_POOL_TIMEOUT
+), get_updates_request=create_service_request())
+# Служебные вызовы не конкурируют с отправкой ответов за соединения
+admin_bot = Bot(token=TOKEN, base_url=f'{TELEGRAM_API_URL}/bot', request=create_service_request(),
+                get_updates_request=create_service_request())
+
+# Очередь исходящих сообщений
+outbox = SendDispatcher(
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST,
+    SEND_MAX_PENDING, SEND_CONCURRENCY, SEND_MAX_RETRIES
+) if SEND_RATE_LIMIT else None
+
+# Тексты бота
+catalog = ContentCatalog(CONTENT_PATH, CONTENT_RELOAD_INTERVAL)
+
+# Подписчики рассылки
+subscribers = SubscriberStore(SUBSCRIBERS_DB) if SUBSCRIBERS_DB else None
 
 # Хранилище данных пользователей
-user_data = {}
+user_data = create_state_store(STATE_BACKEND, STATE_DB_PATH, STATE_TTL, STATE_MAX_ENTRIES)
+
+# Уже полученные обновления, общие для воркеров при STATE_BACKEND=sqlite
+seen_updates = create_seen_updates(
+    STATE_BACKEND, STATE_DB_PATH, DEDUP_WINDOW, DEDUP_MAX_ENTRIES
+) if DEDUP_WINDOW > 0 else None
+
+# Кеш сгенерированных текстов
+response_cache = create_response_cache(
+    CACHE_BACKEND, CACHE_DB_PATH, CACHE_MAX_ENTRIES, CACHE_VARIANTS, CACHE_TTL
+) if CACHE_MAX_ENTRIES > 0 else None
+
+# Заранее сгенерированный корпус на день
+corpus_store = CorpusStore(CORPUS_DIR) if CORPUS_DIR else None
+
+# Одинаковые одновременные запросы к Gemini выполняются один раз
+gemini_flights = SingleFlight()
+
+# Лимиты AI запросов по чатам и справедливая очередь к Gemini
+admission = AdmissionController(
+    AI_CHAT_RATE, AI_CHAT_BURST, GEMINI_MAX_CONCURRENT, GEMINI_MAX_WAITING, GEMINI_QUEUE_TIMEOUT
+) if ADMISSION_CONTROL else None
+
+# Отключение Gemini при серии ошибок
+gemini_breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET_TIMEOUT, GEMINI_SLOW_CALL)
+
+def get_loop():
+    """Возвращает общий event loop, запуская его поток при первом вызове"""
+    global loop
+    with loop_lock:
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='event-loop', daemon=True).start()
+    return loop
+
+def run_sync(coro):
+    """Выполняет корутину в общем event loop и ждет результат"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
 
 def run_async(func):
     """Декоратор для запуска асинхронных функций"""
     @wraps(func)
     def wrapper(*args, **kwargs):
-        return loop.run_until_complete(func(*args, **kwargs))
+        return run_sync(func(*args, **kwargs))
     return wrapper
 
-def get_zodiac_sign(day, month):
-    """Определяет знак зодиака по дате"""
-    if (month == 3 and day >= 21) or (month == 4 and day <= 19):
-        return "♈ Овен"
-    elif (month == 4 and day >= 20) or (month == 5 and day <= 20):
-        return "♉ Телец"
-    elif (month == 5 and day >= 21) or (month == 6 and day <= 20):
-        return "♊ Близнецы"
-    elif (month == 6 and day >= 21) or (month == 7 and day <= 22):
-        return "♋ Рак"
-    elif (month == 7 and day >= 23) or (month == 8 and day <= 22):
-        return "♌ Лев"
-    elif (month == 8 and day >= 23) or (month == 9 and day <= 22):
-        return "♍ Дева"
-    elif (month == 9 and day >= 23) or (month == 10 and day <= 22):
-        return "♎ Весы"
-    elif (month == 10 and day >= 23) or (month == 11 and day <= 21):
-        return "♏ Скорпион"
-    elif (month == 11 and day >= 22) or (month == 12 and day <= 21):
-        return "♐ Стрелец"
-    elif (month == 12 and day >= 22) or (month == 1 and day <= 19):
-        return "♑ Козерог"
-    elif (month == 1 and day >= 20) or (month == 2 and day <= 18):
-        return "♒ Водолей"
+def compatibility_prompt(sign1, sign2):
+    return f"""Напиши краткий анализ совместимости для пары (2-3 предложения):
+Человек 1: {sign1}
+Человек 2: {sign2}
+
+Опиши их сильные стороны в отношениях."""
+
+def numerology_prompt(life_path):
+    return f"""Напиши описание числа жизненного пути {life_path} (3-4 предложения):
+Включи: характер, таланты, жизненное предназначение, вызовы.
+Используй эмодзи."""
+
+def astrology_prompt(zodiac):
+    return f"""Напиши прогноз для знака {zodiac} на текущий период (3-4 предложения):
+Включи: общий настрой, сферы успеха, на что обратить внимание.
+Используй эмодзи."""
+
+def synastry_prompt(sign1, sign2):
+    return f"""Напиши краткую синастрию для пары (2-3 предложения):
+Человек 1: {sign1}
+Человек 2: {sign2}
+
+Опиши динамику их отношений."""
+
+def life_path_prompt(life_path):
+    return f"""Напиши о значении числа жизненного пути {life_path} (2-3 предложения):
+Расскажи о предназначении и миссии."""
+
+def profile_prompt(zodiac, life_path):
+    return f"""Напиши краткую характеристику личности (2-3 предложения):
+Знак: {zodiac}
+Число пути: {life_path}
+
+Опиши характер и особенности."""
+
+# Функции с AI текстами: (построитель промпта, максимальная длина)
+AI_FEATURES = {
+    'compatibility': (compatibility_prompt, 300),
+    'numerology': (numerology_prompt, 400),
+    'astrology': (astrology_prompt, 400),
+    'synastry': (synastry_prompt, 300),
+    'life_path': (life_path_prompt, 300),
+    'profile': (profile_prompt, 300),
+}
+
+def iter_feature_inputs(feature):
+    """Все нормализованные входные данные для функции бота"""
+    if feature in ('compatibility', 'synastry'):
+        for i, sign1 in enumerate(ZODIAC_SIGNS):
+            for sign2 in ZODIAC_SIGNS[i:]:
+                yield tuple(sorted((sign1, sign2)))
+    elif feature == 'astrology':
+        for sign in ZODIAC_SIGNS:
+            yield (sign,)
+    elif feature in ('numerology', 'life_path'):
+        for number in LIFE_PATH_NUMBERS:
+            yield (number,)
+    elif feature == 'profile':
+        for sign in ZODIAC_SIGNS:
+            for number in LIFE_PATH_NUMBERS:
+                yield (sign, number)
+
+async def generate_feature(feature, *inputs, on_progress=None, chat_id=None):
+    """AI текст для функции бота по нормализованным входным данным"""
+    build_prompt, max_length = AI_FEATURES[feature]
+    return await generate_with_gemini(
+        build_prompt(*inputs), max_length=max_length, cache_key=(feature,) + inputs,
+        on_progress=on_progress, chat_id=chat_id
+    )
+
+async def reply_with_feature(chat_id, render, fallback, feature, *inputs):
+    """Отправляет render(AI текст), а если его нет - render(fallback())
+
+    При GEMINI_STREAM=1 сообщение появляется с первым готовым предложением
+    ответа Gemini и дописывается по мере генерации.
+    """
+    stream = None
+    on_progress = None
+    if GEMINI_STREAM:
+        stream = MessageStream(
+            lambda text: send_message(chat_id, text),
+            lambda message_id, text: edit_message(chat_id, message_id, text),
+            STREAM_EDIT_INTERVAL
+        )
+        on_progress = lambda partial: stream.update(render(f'{partial} ✍️'))
+    
+    ai_analysis = await generate_feature(feature, *inputs, on_progress=on_progress, chat_id=chat_id)
+    response = render(ai_analysis or fallback())
+    
+    if stream and stream.started:
+        await stream.finish(response)
     else:
-        return "♓ Рыбы"
+        await send_message(chat_id, response)
 
-def get_life_path_number(day, month, year):
-    """Вычисляет число жизненного пути"""
-    total = sum(int(d) for d in str(day) + str(month) + str(year))
-    while total > 9 and total not in [11, 22, 33]:
-        total = sum(int(d) for d in str(total))
-    return total
+def remember_subscriber(chat_id, birth):
+    """Сохраняет пользователя для ежедневной рассылки прогноза"""
+    if not subscribers:
+        return
+    try:
+        subscribers.add(chat_id, birth.sign, str(birth))
+    except Exception as e:
+        logger.error(f"Error saving subscriber: {e}")
 
-def generate_with_gemini(prompt, max_length=400):
-    """Генерирует текст через Gemini с резервными вариантами"""
-    if not GEMINI_AVAILABLE:
+def get_cache_ttl(feature):
+    """Время жизни кеша для функции бота в секундах"""
+    if feature in DAILY_FEATURES:
+        now = datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        return (midnight - now).total_seconds()
+    return CACHE_TTL
+
+async def stream_text(full_prompt, max_length, on_progress):
+    """Потоковый запрос к Gemini
+
+    on_progress получает законченные предложения, уже укладывающиеся в
+    max_length. Как только остаток ответа уже не может попасть в текст
+    (truncator.full), чтение потока прекращается.
+    """
+    response = await model.generate_content_async(full_prompt, stream=True)
+    chunks = response.__aiter__()
+    truncator = SentenceTruncator(max_length)
+    shown = 0
+    try:
+        async for chunk in chunks:
+            visible = truncator.feed(chunk.text)
+            if len(visible) > shown:
+                shown = len(visible)
+                on_progress(visible)
+            if truncator.full:
+                break
+    finally:
+        await chunks.aclose()
+    return truncator.result()
+
+async def generate_text(prompt, max_length=400, on_progress=None, use_breaker=True):
+    """Запрос к Gemini без кеша
+
+    on_progress(text) - если задан и включен GEMINI_STREAM, ответ читается
+    потоком и функция вызывается с уже готовой частью текста.
+    use_breaker=False - для пакетных задач с собственными повторами:
+    circuit breaker защищает время ответа пользователям.
+    """
+    if model is None and await asyncio.to_thread(get_model) is None:
         return None
     
+    if use_breaker and not gemini_breaker.allow():
+        return None
+    
+    started = time.monotonic()
+    succeeded = False
+    outcome = 'error'
     try:
         # Добавляем инструкции к промпту
         full_prompt = f"""{prompt}
@@ -105,582 +456,531 @@ def generate_with_gemini(prompt, max_length=400):
 - Пиши на русском языке
 - Не используй заголовки и форматирование markdown"""
 
-        response = model.generate_content(full_prompt)
+        if on_progress and GEMINI_STREAM:
+            text = await asyncio.wait_for(stream_text(full_prompt, max_length, on_progress), GEMINI_TIMEOUT)
+        else:
+            response = await asyncio.wait_for(model.generate_content_async(full_prompt), GEMINI_TIMEOUT)
+            text = response.text if response else None
+        succeeded = True
+        outcome = 'success'
+        if use_breaker:
+            gemini_breaker.record_success(time.monotonic() - started)
         
-        if response and response.text:
-            text = response.text.strip()
-            
+        if text and text.strip():
             # Ограничиваем длину
-            if len(text) > max_length:
-                # Обрезаем по последнему предложению
-                sentences = text.split('.')
-                result = ""
-                for sentence in sentences:
-                    if len(result + sentence + '.') <= max_length:
-                        result += sentence + '.'
-                    else:
-                        break
-                text = result if result else text[:max_length]
-            
-            return text
+            return truncate(text.strip(), max_length)
         
         return None
         
+    except asyncio.TimeoutError as e:
+        outcome = 'timeout'
+        count_error('gemini', e)
+        logger.warning(f"Gemini timeout after {GEMINI_TIMEOUT}s")
+        return None
     except Exception as e:
+        count_error('gemini', e)
         logger.error(f"Gemini error: {e}")
         return None
+    finally:
+        GEMINI_LATENCY.labels(outcome=outcome).observe(time.monotonic() - started)
+        if use_breaker and not succeeded:
+            gemini_breaker.record_failure()
 
-@run_async
-async def send_message(chat_id, text, reply_markup=None):
-    """Отправка сообщения"""
-    await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup, parse_mode=None)
+async def cache_call(method, *args):
+    """Вызов метода кеша; блокирующий (sqlite) - в потоке, не в event loop"""
+    if response_cache.blocking:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+async def get_degraded_text(cache_key, feature):
+    """Текст без вызова Gemini: любой сохраненный вариант или None (резервный текст)"""
+    text = await cache_call(response_cache.get_any, cache_key) if cache_key and response_cache else None
+    count_ai_response(feature, 'degraded' if text else 'fallback')
+    return text
+
+async def generate_with_gemini(prompt, max_length=400, cache_key=None, on_progress=None, chat_id=None):
+    """Генерирует текст через Gemini с резервными вариантами
 
-def get_compatibility(sign1, sign2):
-    """Определяет совместимость двух знаков"""
-    s1 = sign1.split()[0]
-    s2 = sign2.split()[0]
+    cache_key - (функция, нормализованные входные данные), от которых
+    зависит промпт. Если задан, текст сначала ищется в заранее
+    сгенерированном корпусе и в кеше, а новый ответ сохраняется в кеш.
+    on_progress - см. generate_text; вызывается, только если этот вызов
+    сам обращается к Gemini, а не ждет такой же запрос другого чата.
+    chat_id - чат, для которого текст; его запросы к Gemini ограничиваются
+    admission (без chat_id - только общим лимитом одновременных вызовов).
+    Ожидание такого же запроса другого чата лимит чата не расходует.
+    """
+    feature = cache_key[0] if cache_key else 'other'
     
-    compatibility_map = {
-        ('♈', '♌'): 95, ('♈', '♐'): 90, ('♈', '♊'): 85,
-        ('♉', '♍'): 95, ('♉', '♑'): 90, ('♉', '♋'): 85,
-        ('♊', '♎'): 95, ('♊', '♒'): 90, ('♊', '♈'): 85,
-        ('♋', '♏'): 95, ('♋', '♓'): 90, ('♋', '♉'): 85,
-        ('♌', '♈'): 95, ('♌', '♐'): 90, ('♌', '♊'): 85,
-        ('♍', '♉'): 95, ('♍', '♑'): 90, ('♍', '♏'): 85,
-        ('♎', '♊'): 95, ('♎', '♒'): 90, ('♎', '♐'): 85,
-        ('♏', '♋'): 95, ('♏', '♓'): 90, ('♏', '♑'): 85,
-        ('♐', '♈'): 90, ('♐', '♌'): 90, ('♐', '♎'): 85,
-        ('♑', '♉'): 90, ('♑', '♍'): 90, ('♑', '♏'): 85,
-        ('♒', '♊'): 90, ('♒', '♎'): 90, ('♒', '♐'): 85,
-        ('♓', '♋'): 90, ('♓', '♏'): 90, ('♓', '♉'): 85,
-    }
+    if cache_key and corpus_store:
+        text = corpus_store.get(cache_key)
+        if text:
+            count_ai_response(feature, 'corpus')
+            return text
+    
+    if not GEMINI_AVAILABLE:
+        count_ai_response(feature, 'fallback')
+        return None
     
-    score = compatibility_map.get((s1, s2)) or compatibility_map.get((s2, s1)) or 70
+    if cache_key and response_cache:
+        cached = await cache_call(response_cache.get, cache_key)
+        if cached:
+            count_ai_response(feature, 'cache')
+            return cached
     
-    if score >= 90:
-        level = "Отличная"
-        emoji = "💚💚💚"
-    elif score >= 80:
-        level = "Хорошая"
-        emoji = "💚💚"
-    elif score >= 70:
-        level = "Средняя"
-        emoji = "💛"
-    else:
-        level = "Низкая"
-        emoji = "🧡"
+    async def generate():
+        # Лимит чата списывается только с лидера, который действительно
+        # вызывает Gemini: присоединившиеся к его запросу токен не тратят
+        if admission and chat_id is not None and not admission.allow(chat_id):
+            return None
+        if admission and not await admission.acquire(chat_id):
+            return None
+        try:
+            text = await generate_text(prompt, max_length, on_progress)
+        finally:
+            if admission:
+                admission.release()
+        if text and cache_key and response_cache:
+            # Ошибка записи в кеш (sqlite: database is locked) не должна
+            # превращать готовый ответ в ошибку для всех ждущих его запросов
+            try:
+                await cache_call(response_cache.put, cache_key, text, get_cache_ttl(cache_key[0]))
+            except Exception as e:
+                count_error('cache', e)
+                logger.error(f"Error caching AI text: {e}")
+        return text
+    
+    text = await gemini_flights.do(cache_key or (prompt, max_length), generate)
+    if text:
+        count_ai_response(feature, 'gemini')
+        return text
+    # Gemini не ответил или вызов не допущен - сохраненный вариант лучше шаблона
+    return await get_degraded_text(cache_key, feature)
+
+async def send_message(chat_id, text, reply_markup=None):
+    """Отправка сообщения"""
+    async def do_send():
+        started = time.perf_counter()
+        try:
+            return await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup, parse_mode=None)
+        except Exception as e:
+            count_error('telegram', e)
+            raise
+        finally:
+            TELEGRAM_SEND_LATENCY.observe(time.perf_counter() - started)
+    
+    if outbox:
+        return await outbox.send(chat_id, do_send)
+    return await do_send()
+
+async def edit_message(chat_id, message_id, text):
+    """Изменение отправленного сообщения"""
+    async def do_edit():
+        started = time.perf_counter()
+        try:
+            return await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, parse_mode=None)
+        except Exception as e:
+            count_error('telegram', e)
+            raise
+        finally:
+            TELEGRAM_SEND_LATENCY.observe(time.perf_counter() - started)
     
-    return score, level, emoji
+    if outbox:
+        return await outbox.send(chat_id, do_edit)
+    return await do_edit()
 
 def get_compatibility_fallback(sign1, sign2):
     """Резервный текст для совместимости"""
-    templates = [
-        f"Ваши знаки {sign1} и {sign2} создают гармоничный союз! 💫 Вы дополняете друг друга и понимаете с полуслова.",
-        f"Союз {sign1} и {sign2} обещает быть ярким! ✨ У вас много общего, хотя иногда возможны небольшие разногласия.",
-        f"Пара {sign1} и {sign2} - это интересное сочетание! 🌟 Вы можете многому научиться друг у друга."
-    ]
-    return random.choice(templates)
+    return random.choice(catalog.get().compatibility_templates).format(sign1=sign1, sign2=sign2)
 
-def handle_start(chat_id):
+@track_handler
+async def handle_start(chat_id):
     """Обработка команды /start"""
-    keyboard = [
-        [InlineKeyboardButton("🔮 Astrology insights", callback_data='astrology')],
-        [InlineKeyboardButton("💕 Relationship compatibility", callback_data='compatibility')],
-        [InlineKeyboardButton("🔢 Personal numerology report", callback_data='numerology')],
-        [InlineKeyboardButton("✨ Premium версия", callback_data='premium')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    response = (
-        '🌟 Добро пожаловать в AstroHarmony!\n\n'
-        'Я помогу вам узнать:\n'
-        '• Совместимость в отношениях 💕\n'
-        '• Астрологические прогнозы 🔮\n'
-        '• Нумерологический анализ 🔢\n'
-        '• Анализ синастрии ⭐\n'
-        '• И многое другое!\n\n'
-        'Выберите интересующую функцию:'
-    )
-    send_message(chat_id, response, reply_markup)
+    content = catalog.get()
+    await send_message(chat_id, content.replies['start'], content.start_keyboard)
 
-def handle_help(chat_id):
+@track_handler
+async def handle_help(chat_id):
     """Обработка команды /help"""
-    response = (
-        '📚 Доступные команды:\n\n'
-        '/start - Главное меню\n'
-        '/compatibility - Совместимость пар\n'
-        '/numerology - Нумерология\n'
-        '/astrology - Астрологический анализ\n'
-        '/synastry - Синастрия двух людей\n'
-        '/life_path - Число жизненного пути\n'
-        '/tarot - Мини расклад Таро\n'
-        '/profile - Ваш астропрофиль\n'
-        '/feedback - Оставить отзыв\n'
-        '/premium - Premium версия\n\n'
-        '💎 В Premium больше деталей и точности!'
-    )
-    send_message(chat_id, response)
+    await send_message(chat_id, catalog.get().replies['help'])
 
-def handle_compatibility_request(chat_id):
+@track_handler
+async def handle_compatibility_request(chat_id):
     """Запрос данных для совместимости"""
-    user_data[chat_id] = {'waiting_for': 'compatibility'}
-    response = (
-        '💕 Анализ совместимости\n\n'
-        'Отправьте две даты рождения в формате:\n'
-        '10.10.2010 и 30.07.2007'
-    )
-    send_message(chat_id, response)
+    user_data.set(chat_id, 'compatibility')
+    await send_message(chat_id, catalog.get().replies['compatibility'])
 
-def handle_compatibility(chat_id, date1, date2):
+@track_handler
+async def handle_compatibility(chat_id, birth1, birth2):
     """Обработка совместимости"""
     try:
-        parts1 = date1.strip().split('.')
-        day1, month1, year1 = map(int, parts1)
-        
-        parts2 = date2.strip().split('.')
-        day2, month2, year2 = map(int, parts2)
-        
-        sign1 = get_zodiac_sign(day1, month1)
-        sign2 = get_zodiac_sign(day2, month2)
+        sign1 = birth1.sign
+        sign2 = birth2.sign
         
         score, level, emoji = get_compatibility(sign1, sign2)
         
-        # Пробуем Gemini
-        prompt = f"""Напиши краткий анализ совместимости для пары (2-3 предложения):
-Человек 1: {sign1}
-Человек 2: {sign2}
-
-Опиши их сильные стороны в отношениях."""
-        
-        ai_analysis = generate_with_gemini(prompt, max_length=300)
+        def render(ai_analysis):
+            response = f'📅 Дата 1: {birth1}\n'
+            response += f'🌟 Знак: {sign1}\n\n'
+            response += f'📅 Дата 2: {birth2}\n'
+            response += f'🌟 Знак: {sign2}\n\n'
+            response += f'💕 Совместимость: {level} {emoji}\n'
+            response += f'📊 Оценка: {score}%\n\n'
+            response += f'🔮 Анализ:\n{ai_analysis}\n\n'
+            response += '✨ Хотите детальный анализ? /premium'
+            return response
         
         # Если Gemini не сработал, используем резервный вариант
-        if not ai_analysis:
-            ai_analysis = get_compatibility_fallback(sign1, sign2)
-        
-        response = f'📅 Дата 1: {date1}\n'
-        response += f'🌟 Знак: {sign1}\n\n'
-        response += f'📅 Дата 2: {date2}\n'
-        response += f'🌟 Знак: {sign2}\n\n'
-        response += f'💕 Совместимость: {level} {emoji}\n'
-        response += f'📊 Оценка: {score}%\n\n'
-        response += f'🔮 Анализ:\n{ai_analysis}\n\n'
-        response += '✨ Хотите детальный анализ? /premium'
-        
-        send_message(chat_id, response)
+        await reply_with_feature(
+            chat_id, render, lambda: get_compatibility_fallback(sign1, sign2),
+            'compatibility', *sorted((sign1, sign2))
+        )
         
     except Exception as e:
+        count_error('handler', e)
         logger.error(f"Error in compatibility: {e}")
-        send_message(chat_id, "❌ Ошибка. Формат: ДД.ММ.ГГГГ и ДД.ММ.ГГГГ")
+        await send_message(chat_id, catalog.get().replies['error'])
 
-def handle_numerology(chat_id):
+@track_handler
+async def handle_numerology(chat_id):
     """Запрос даты для нумерологии"""
-    user_data[chat_id] = {'waiting_for': 'numerology'}
-    response = (
-        '🔢 Нумерологический отчет\n\n'
-        'Отправьте дату рождения:\n'
-        'ДД.ММ.ГГГГ (например: 15.03.1990)'
-    )
-    send_message(chat_id, response)
+    user_data.set(chat_id, 'numerology')
+    await send_message(chat_id, catalog.get().replies['numerology'])
 
-def handle_numerology_analysis(chat_id, date):
+@track_handler
+async def handle_numerology_analysis(chat_id, birth):
     """Нумерологический анализ"""
     try:
-        day, month, year = map(int, date.split('.'))
+        life_path = birth.life_path
+        zodiac = birth.sign
+        remember_subscriber(chat_id, birth)
         
-        life_path = get_life_path_number(day, month, year)
-        zodiac = get_zodiac_sign(day, month)
+        def fallback():
+            content = catalog.get()
+            return content.numerology.get(life_path, content.numerology_default)
         
-        prompt = f"""Напиши описание числа жизненного пути {life_path} (3-4 предложения):
-Включи: характер, таланты, жизненное предназначение, вызовы.
-Используй эмодзи."""
-        
-        ai_analysis = generate_with_gemini(prompt, max_length=400)
+        def render(ai_analysis):
+            response = f'🔢 Нумерологический анализ\n\n'
+            response += f'📅 Дата: {birth}\n'
+            response += f'🌟 Знак: {zodiac}\n'
+            response += f'🔮 Число жизненного пути: {life_path}\n\n'
+            response += f'📊 Краткое описание:\n{ai_analysis}\n\n'
+            response += '━━━━━━━━━━━━━━━\n'
+            response += '💎 В Premium версии:\n'
+            response += '• Все личные числа (душа, судьба, имя)\n'
+            response += '• Персональный год и месяц\n'
+            response += '• Кармические долги и уроки\n'
+            response += '• Совместимость по числам\n'
+            response += '• Благоприятные даты и циклы\n\n'
+            response += '✨ Узнать больше: /premium'
+            return response
         
-        if not ai_analysis:
-            meanings = {
-                1: "Вы прирожденный лидер и первопроходец! 👑 Независимость, инициативность и смелость - ваши главные качества. Вы умеете вдохновлять других своим примером и не боитесь идти непроторенными путями. Ваша миссия - создавать новое и вести людей за собой.",
-                2: "Вы миротворец и дипломат! 🕊️ Чуткость, способность к сотрудничеству и понимание других - ваши сильные стороны. Вы мастерски находите баланс в конфликтах и создаете гармонию вокруг себя. Ваш дар - объединять людей и строить крепкие партнерства.",
-                3: "Вы творческая и жизнерадостная личность! 🎨 Общительность, оптимизм и артистизм делают вас душой компании. Самовыражение через искусство, слова или музыку - ваше призвание. Вы приносите радость и вдохновение в жизнь окружающих.",
-                4: "Вы надежный, практичный и трудолюбивый! 🏗️ Дисциплина, организованность и терпение - фундамент вашего успеха. Вы создаете прочные структуры и системы, на которые можно положиться. Ваша миссия - строить стабильное будущее.",
-                5: "Вы свободолюбивы, любознательны и динамичны! ✈️ Жажда приключений, перемен и новых впечатлений движет вами по жизни. Гибкость и адаптивность помогают преуспевать в любых условиях. Вы несете энергию изменений и прогресса.",
-                6: "Вы заботливы, ответственны и преданы! 💝 Гармония в семье и служение близким для вас на первом месте. У вас природный дар целителя и советчика. Вы создаете атмосферу любви, красоты и комфорта вокруг себя.",
-                7: "Вы мудрый аналитик и духовный искатель! 🧘 Глубокие размышления, интуиция и стремление к истине определяют ваш путь. Вам нужно уединение для познания себя и мира. Ваша миссия - делиться мудростью и помогать другим прозреть.",
-                8: "Вы амбициозны, сильны и целеустремленны! 💰 Материальный успех, власть и авторитет даются вам через упорный труд. У вас природный дар управления и организации крупных проектов. Вы способны достичь вершин в бизнесе и карьере.",
-                9: "Вы гуманист, идеалист и филантроп! 🌍 Сострадание, щедрость и желание помогать человечеству - ваша суть. Вы видите общую картину и работаете ради высших целей. Ваша миссия - делать мир лучше и вдохновлять других на добро.",
-                11: "У вас мастер-число интуиции и вдохновения! ⚡ Вы духовный учитель с развитыми экстрасенсорными способностями. Ваши идеи и прозрения могут изменить мир. Высокая чувствительность требует заземления, но дает доступ к высшим знаниям.",
-                22: "У вас мастер-число строителя мечты! 🌟 Вы можете воплотить грандиозные идеи в реальность и создать что-то масштабное. Сочетание практичности и видения делает вас архитектором будущего. Ваш потенциал влияния огромен.",
-                33: "У вас мастер-число учителя любви! 💫 Вы несете безусловную любовь, сострадание и исцеление в мир. Ваше присутствие трансформирует и возвышает других. Служение человечеству через любовь - ваше высшее предназначение."
-            }
-            ai_analysis = meanings.get(life_path, "У вас особенное число! ✨ Вы уникальны и талантливы, ваш путь полон открытий.")
-        
-        response = f'🔢 Нумерологический анализ\n\n'
-        response += f'📅 Дата: {date}\n'
-        response += f'🌟 Знак: {zodiac}\n'
-        response += f'🔮 Число жизненного пути: {life_path}\n\n'
-        response += f'📊 Краткое описание:\n{ai_analysis}\n\n'
-        response += '━━━━━━━━━━━━━━━\n'
-        response += '💎 В Premium версии:\n'
-        response += '• Все личные числа (душа, судьба, имя)\n'
-        response += '• Персональный год и месяц\n'
-        response += '• Кармические долги и уроки\n'
-        response += '• Совместимость по числам\n'
-        response += '• Благоприятные даты и циклы\n\n'
-        response += '✨ Узнать больше: /premium'
-        
-        send_message(chat_id, response)
+        await reply_with_feature(chat_id, render, fallback, 'numerology', life_path)
         
     except Exception as e:
+        count_error('handler', e)
         logger.error(f"Error in numerology: {e}")
-        send_message(chat_id, "❌ Неверный формат. Используйте: ДД.ММ.ГГГГ")
-def handle_astrology(chat_id):
+        await send_message(chat_id, catalog.get().replies['error'])
+@track_handler
+async def handle_astrology(chat_id):
     """Запрос даты для астрологии"""
-    user_data[chat_id] = {'waiting_for': 'astrology'}
-    response = (
-        '🔮 Астрологический анализ\n\n'
-        'Отправьте дату рождения:\n'
-        'ДД.ММ.ГГГГ'
-    )
-    send_message(chat_id, response)
+    user_data.set(chat_id, 'astrology')
+    await send_message(chat_id, catalog.get().replies['astrology'])
 
-def handle_astrology_analysis(chat_id, date):
+def get_forecast_fallback(zodiac):
+    """Резервный прогноз для знака"""
+    content = catalog.get()
+    return content.forecasts.get(zodiac, content.forecast_default)
+
+async def get_forecast(zodiac):
+    """Прогноз для знака: AI текст или резервный"""
+    return await generate_feature('astrology', zodiac) or get_forecast_fallback(zodiac)
+
+@track_handler
+async def handle_astrology_analysis(chat_id, birth):
     """Астрологический анализ"""
     try:
-        day, month, year = map(int, date.split('.'))
-        zodiac = get_zodiac_sign(day, month)
-        
-        prompt = f"""Напиши прогноз для знака {zodiac} на текущий период (3-4 предложения):
-Включи: общий настрой, сферы успеха, на что обратить внимание.
-Используй эмодзи."""
-        
-        ai_analysis = generate_with_gemini(prompt, max_length=400)
+        zodiac = birth.sign
+        remember_subscriber(chat_id, birth)
         
-        if not ai_analysis:
-            forecasts = {
-                "♈ Овен": "Сейчас отличное время для новых начинаний! 🚀 Ваша энергия на пике - используйте её для достижения целей. Особенно благоприятны проекты, требующие смелости и инициативы. Будьте осторожны с импульсивными решениями в финансах.",
-                "♉ Телец": "Период стабильности и роста! 🌱 Сосредоточьтесь на финансовых вопросах и близких отношениях. Ваше терпение будет вознаграждено. Идеальное время для инвестиций в долгосрочные проекты и укрепления семейных связей.",
-                "♊ Близнецы": "Время общения и новых знакомств! 💬 Ваши идеи найдут живой отклик у окружающих. Благоприятен период для обучения, путешествий и расширения кругозора. Множество интересных предложений ждут вас.",
-                "♋ Рак": "Обратите особое внимание на дом и семью! 🏡 Эмоциональная гармония сейчас важнее всего. Укрепляйте связи с близкими, создавайте уют. Ваша интуиция особенно сильна - доверяйте внутреннему голосу в важных решениях.",
-                "♌ Лев": "Ваше время сиять! ✨ Творческие проекты принесут успех и признание. Вы в центре внимания - используйте это для продвижения своих идей. Романтика расцветает, а карьерные перспективы открываются.",
-                "♍ Дева": "Идеальный период для планирования и организации! 📋 Ваша внимательность к деталям откроет новые возможности. Здоровье требует внимания - время для полезных привычек. Работа над собой принесет впечатляющие результаты.",
-                "♎ Весы": "Гармония в отношениях на первом плане! ⚖️ Партнерство и сотрудничество особенно благоприятны сейчас. Идеальное время для решения конфликтов и поиска компромиссов. Красота и искусство вдохновляют вас на новые свершения.",
-                "♏ Скорпион": "Время глубокой трансформации! 🔮 Ваша интуиция работает на полную мощность - доверяйте ей. Возможны важные открытия о себе и окружающих. Финансовые вопросы требуют пристального внимания, но решаются в вашу пользу.",
-                "♐ Стрелец": "Расширяйте свои горизонты! 🎯 Новые возможности ждут вас впереди - не бойтесь рисковать. Путешествия, обучение и философские размышления принесут пользу. Ваш оптимизм заразителен и притягивает удачу.",
-                "♑ Козерог": "Упорный труд начинает приносить плоды! ⛰️ Ваши усилия не останутся незамеченными - карьерный рост близко. Время строить прочный фундамент для будущего. Авторитет растет, признание придет.",
-                "♒ Водолей": "Инновации и оригинальность в центре внимания! 💡 Ваши уникальные идеи находят поддержку. Дружба и социальные связи особенно важны сейчас. Технологии и новые методы работы открывают перспективы.",
-                "♓ Рыбы": "Период духовного роста и творчества! 🎨 Слушайте свое сердце и позвольте интуиции вести вас. Искусство, музыка и медитация помогут найти внутреннюю гармонию. Помощь другим принесет неожиданные благословения."
-            }
-            ai_analysis = forecasts.get(zodiac, "Прекрасный период для саморазвития и новых начинаний! 🌟 Звезды благоволят вам в начинаниях. Доверяйте интуиции и действуйте смело.")
+        def render(ai_analysis):
+            response = f'🔮 Астрологический анализ\n\n'
+            response += f'📅 Дата: {birth}\n'
+            response += f'🌟 Знак: {zodiac}\n\n'
+            response += f'📊 Краткий прогноз:\n{ai_analysis}\n\n'
+            response += '━━━━━━━━━━━━━━━\n'
+            response += '💎 В Premium версии:\n'
+            response += '• Детальный прогноз на месяц/год\n'
+            response += '• Анализ транзитов планет\n'
+            response += '• Благоприятные даты для событий\n'
+            response += '• Рекомендации по сферам жизни\n'
+            response += '• Анализ домов гороскопа\n\n'
+            response += '✨ Узнать больше: /premium'
+            return response
         
-        response = f'🔮 Астрологический анализ\n\n'
-        response += f'📅 Дата: {date}\n'
-        response += f'🌟 Знак: {zodiac}\n\n'
-        response += f'📊 Краткий прогноз:\n{ai_analysis}\n\n'
-        response += '━━━━━━━━━━━━━━━\n'
-        response += '💎 В Premium версии:\n'
-        response += '• Детальный прогноз на месяц/год\n'
-        response += '• Анализ транзитов планет\n'
-        response += '• Благоприятные даты для событий\n'
-        response += '• Рекомендации по сферам жизни\n'
-        response += '• Анализ домов гороскопа\n\n'
-        response += '✨ Узнать больше: /premium'
-        
-        send_message(chat_id, response)
+        await reply_with_feature(chat_id, render, lambda: get_forecast_fallback(zodiac), 'astrology', zodiac)
         
     except Exception as e:
-        send_message(chat_id, "❌ Неверный формат даты")
-def handle_synastry(chat_id):
+        count_error('handler', e)
+        await send_message(chat_id, catalog.get().replies['error'])
+@track_handler
+async def handle_synastry(chat_id):
     """Запрос для синастрии"""
-    user_data[chat_id] = {'waiting_for': 'synastry'}
-    response = (
-        '⭐ Синастрия - анализ двух людей\n\n'
-        'Отправьте две даты:\n'
-        '10.10.2010 и 30.07.2007'
-    )
-    send_message(chat_id, response)
+    user_data.set(chat_id, 'synastry')
+    await send_message(chat_id, catalog.get().replies['synastry'])
 
-def handle_synastry_analysis(chat_id, date1, date2):
+@track_handler
+async def handle_synastry_analysis(chat_id, birth1, birth2):
     """Анализ синастрии"""
     try:
-        parts1 = date1.strip().split('.')
-        day1, month1, year1 = map(int, parts1)
-        
-        parts2 = date2.strip().split('.')
-        day2, month2, year2 = map(int, parts2)
-        
-        sign1 = get_zodiac_sign(day1, month1)
-        sign2 = get_zodiac_sign(day2, month2)
-        
-        prompt = f"""Напиши краткую синастрию для пары (2-3 предложения):
-Человек 1: {sign1}
-Человек 2: {sign2}
-
-Опиши динамику их отношений."""
+        sign1 = birth1.sign
+        sign2 = birth2.sign
         
-        ai_analysis = generate_with_gemini(prompt, max_length=300)
+        def fallback():
+            return catalog.get().synastry_template.format(sign1=sign1, sign2=sign2)
         
-        if not ai_analysis:
-            ai_analysis = f"Ваши энергии {sign1} и {sign2} создают уникальную динамику! 💫 В отношениях есть как гармония, так и точки роста. Вместе вы можете достичь многого!"
+        def render(ai_analysis):
+            response = f'⭐ Синастрия\n\n'
+            response += f'👤 Человек 1: {sign1}\n'
+            response += f'👤 Человек 2: {sign2}\n\n'
+            response += f'{ai_analysis}\n\n'
+            response += '✨ Полная синастрия с домами: /premium'
+            return response
         
-        response = f'⭐ Синастрия\n\n'
-        response += f'👤 Человек 1: {sign1}\n'
-        response += f'👤 Человек 2: {sign2}\n\n'
-        response += f'{ai_analysis}\n\n'
-        response += '✨ Полная синастрия с домами: /premium'
-        
-        send_message(chat_id, response)
+        await reply_with_feature(chat_id, render, fallback, 'synastry', *sorted((sign1, sign2)))
         
     except Exception as e:
-        send_message(chat_id, "❌ Ошибка. Формат: ДД.ММ.ГГГГ и ДД.ММ.ГГГГ")
+        count_error('handler', e)
+        await send_message(chat_id, catalog.get().replies['error'])
 
-def handle_life_path(chat_id):
+@track_handler
+async def handle_life_path(chat_id):
     """Запрос для числа пути"""
-    user_data[chat_id] = {'waiting_for': 'life_path'}
-    response = (
-        '🛤️ Число жизненного пути\n\n'
-        'Отправьте дату рождения:\n'
-        'ДД.ММ.ГГГГ'
-    )
-    send_message(chat_id, response)
+    user_data.set(chat_id, 'life_path')
+    await send_message(chat_id, catalog.get().replies['life_path'])
 
-def handle_life_path_analysis(chat_id, date):
+@track_handler
+async def handle_life_path_analysis(chat_id, birth):
     """Анализ числа жизненного пути"""
     try:
-        day, month, year = map(int, date.split('.'))
-        life_path = get_life_path_number(day, month, year)
-        
-        prompt = f"""Напиши о значении числа жизненного пути {life_path} (2-3 предложения):
-Расскажи о предназначении и миссии."""
-        
-        ai_analysis = generate_with_gemini(prompt, max_length=300)
+        life_path = birth.life_path
+        remember_subscriber(chat_id, birth)
         
-        if not ai_analysis:
-            missions = {
-                1: "Ваша миссия - быть первопроходцем! 🎯 Вы создаете новые пути и вдохновляете других своей смелостью.",
-                2: "Ваша миссия - объединять людей! 🤝 Гармония и партнерство - ваш дар миру.",
-                3: "Ваша миссия - нести радость! 🎭 Творчество и самовыражение - ваш путь.",
-                4: "Ваша миссия - создавать основу! 🏛️ Надежность и стабильность - ваш вклад.",
-                5: "Ваша миссия - исследовать мир! 🗺️ Свобода и перемены - ваша стихия.",
-                6: "Ваша миссия - заботиться! 💖 Любовь и служение - ваше призвание.",
-                7: "Ваша миссия - искать истину! 📚 Мудрость и духовность - ваш путь.",
-                8: "Ваша миссия - достигать успеха! 🏆 Сила и изобилие - ваши инструменты.",
-                9: "Ваша миссия - помогать человечеству! 🌏 Сострадание и щедрость - ваш дар."
-            }
-            ai_analysis = missions.get(life_path, "Ваша миссия уникальна! ✨ Вы несете особый свет в этот мир.")
+        def fallback():
+            content = catalog.get()
+            return content.life_path.get(life_path, content.life_path_default)
         
-        response = f'🛤️ Число жизненного пути\n\n'
-        response += f'📅 Дата: {date}\n'
-        response += f'🔢 Ваше число: {life_path}\n\n'
-        response += f'{ai_analysis}\n\n'
-        response += '✨ Детальный разбор всех чисел: /premium'
+        def render(ai_analysis):
+            response = f'🛤️ Число жизненного пути\n\n'
+            response += f'📅 Дата: {birth}\n'
+            response += f'🔢 Ваше число: {life_path}\n\n'
+            response += f'{ai_analysis}\n\n'
+            response += '✨ Детальный разбор всех чисел: /premium'
+            return response
         
-        send_message(chat_id, response)
+        await reply_with_feature(chat_id, render, fallback, 'life_path', life_path)
         
     except Exception as e:
-        send_message(chat_id, "❌ Неверный формат даты")
+        count_error('handler', e)
+        await send_message(chat_id, catalog.get().replies['error'])
 
-def handle_tarot(chat_id):
+@track_handler
+async def handle_tarot(chat_id):
     """Мини расклад Таро"""
-    cards = [
-        ("Маг", "Новые возможности и начинания открываются перед вами! ✨ Используйте свои таланты и навыки для достижения целей. Сейчас идеальный момент для манифестации желаемого - у вас есть все необходимые инструменты. Действуйте уверенно и сосредоточенно."),
-        ("Жрица", "Доверьтесь своей интуиции и внутреннему голосу! 🌙 Не все открывается сразу - некоторые тайны требуют времени для понимания. Медитация и самоанализ откроют вам скрытые знания. Прислушайтесь к снам и знакам."),
-        ("Императрица", "Время творчества, изобилия и плодородия! 👑 Природа и красота окружают вас благословениями. Забота о себе и близких принесет радость. Ваши проекты расцветают - позвольте им развиваться естественно."),
-        ("Император", "Структура, порядок и контроль приведут к успеху! ⚔️ Ваша дисциплина и лидерские качества сейчас особенно важны. Установите четкие границы и правила. Стабильный фундамент гарантирует долгосрочный результат."),
-        ("Иерофант", "Следуйте традициям и ищите мудрость в опыте предков! 📖 Обучение у наставников или в формальных структурах принесет пользу. Духовные практики и ритуалы дают опору. Ваши ценности станут маяком для других."),
-        ("Влюбленные", "Важный выбор сердца перед вами! 💕 Прислушайтесь к своим чувствам в принятии решений. Гармония в отношениях и единство противоположностей создают целое. То, что вы выбираете, определит ваш путь."),
-        ("Колесница", "Двигайтесь вперед с решимостью и контролем! 🏇 Ваша целеустремленность и воля преодолеют любые препятствия. Баланс между противоположными силами даст вам скорость. Победа близка - не останавливайтесь сейчас."),
-        ("Сила", "Истинная сила в мягкости и терпении! 🦁 Укротите свои страсти через любовь и понимание. Внутренняя мощь и храбрость помогут справиться с вызовами. Сострадание к себе и другим - ваше секретное оружие."),
-        ("Отшельник", "Время для уединения и самопознания! 🕯️ Внутреннее путешествие принесет ясность и мудрость. Отступите от шума мира, чтобы услышать свой голос. Найденные истины осветят ваш дальнейший путь."),
-        ("Колесо Фортуны", "Судьбоносные перемены и циклы жизни в движении! 🎡 Доверьтесь течению и примите изменения как естественную часть жизни. Удача поворачивается - будьте готовы к новым возможностям. Что посеете, то и пожнете."),
-        ("Справедливость", "Баланс и справедливость восстановятся! ⚖️ Правда выйдет наружу, а честность будет вознаграждена. Принимайте взвешенные решения, основанные на фактах. Каждое действие имеет последствия - выбирайте мудро."),
-        ("Повешенный", "Смените угол зрения и отпустите контроль! 🔄 Иногда необходимо пожертвовать малым ради большего. Период ожидания научит терпению и новому пониманию. Посмотрите на ситуацию с другой стороны."),
-        ("Смерть", "Трансформация и перерождение неизбежны! 🦋 Старое должно уйти, чтобы освободить место новому. Не бойтесь отпускать отжившее. Конец одного цикла - начало другого, более яркого."),
-        ("Умеренность", "Гармония, баланс и терпение - ключи к успеху! 🌈 Смешайте противоположности для создания идеального решения. Умеренность во всем принесет исцеление. Дайте процессу время развиваться естественно."),
-        ("Дьявол", "Освободитесь от ограничивающих убеждений и зависимостей! ⛓️ Осознайте, что держит вас в плену - материальное, страхи или привычки. Вы сильнее своих теней. Первый шаг к свободе - признание проблемы."),
-        ("Башня", "Внезапное разрушение иллюзий и старых структур! ⚡ Хотя это может быть шокирующим, это необходимое очищение. На месте рухнувшей башни вырастет что-то более прочное и истинное. Примите изменения."),
-        ("Звезда", "Надежда, вдохновение и исцеление приходят к вам! ⭐ После бури наступает покой и обновление. Ваши мечты и желания начинают сбываться. Верьте в себя и в божественное руководство - вы на верном пути."),
-        ("Луна", "Интуиция, иллюзии и тайны окружают вас! 🌙 Не все так, как кажется на первый взгляд. Доверяйте подсознанию, но проверяйте факты. Страхи и сомнения скоро рассеются. Луна освещает путь через тьму."),
-        ("Солнце", "Радость, успех и изобилие озаряют вашу жизнь! ☀️ Все складывается наилучшим образом - наслаждайтесь моментом. Ваш внутренний свет сияет ярко и привлекает благословения. Делитесь счастьем с другими."),
-        ("Суд", "Духовное пробуждение и время подвести итоги! 📯 Прошлые действия оцениваются, и приходит понимание их последствий. Возможность начать с чистого листа дана вам. Отпустите старые грехи и примите прощение."),
-        ("Мир", "Завершение важного цикла и достижение целостности! 🌍 Гармония, успех и чувство выполненного долга наполняют вас. Вы достигли того, к чему стремились. Наслаждайтесь моментом перед началом нового путешествия.")
-    ]
-    
-    card_name, card_meaning = random.choice(cards)
-    
-    response = f'🔮 Карта дня: {card_name}\n\n'
-    response += f'📖 Толкование:\n{card_meaning}\n\n'
-    response += '━━━━━━━━━━━━━━━\n'
-    response += '💎 В Premium версии:\n'
-    response += '• Расклады на 3/7/10 карт\n'
-    response += '• Специализированные расклады:\n'
-    response += '  - Кельтский крест\n'
-    response += '  - Любовный треугольник\n'
-    response += '  - Карьерный путь\n'
-    response += '  - Годовой прогноз\n'
-    response += '• Детальная интерпретация\n'
-    response += '• Совет по каждой позиции\n\n'
-    response += '✨ Узнать больше: /premium'
-    
-    send_message(chat_id, response)
+    await send_message(chat_id, random.choice(catalog.get().tarot))
 
-def handle_profile(chat_id):
+@track_handler
+async def handle_profile(chat_id):
     """Астропрофиль пользователя"""
-    user_data[chat_id] = {'waiting_for': 'profile'}
-    response = (
-        '👤 Ваш астропрофиль\n\n'
-        'Отправьте дату рождения:\n'
-        'ДД.ММ.ГГГГ'
-    )
-    send_message(chat_id, response)
+    user_data.set(chat_id, 'profile')
+    await send_message(chat_id, catalog.get().replies['profile'])
 
-def handle_profile_analysis(chat_id, date):
+@track_handler
+async def handle_profile_analysis(chat_id, birth):
     """Создание профиля"""
     try:
-        day, month, year = map(int, date.split('.'))
-        zodiac = get_zodiac_sign(day, month)
-        life_path = get_life_path_number(day, month, year)
-        
-        prompt = f"""Напиши краткую характеристику личности (2-3 предложения):
-Знак: {zodiac}
-Число пути: {life_path}
-
-Опиши характер и особенности."""
+        zodiac = birth.sign
+        life_path = birth.life_path
+        remember_subscriber(chat_id, birth)
         
-        ai_analysis = generate_with_gemini(prompt, max_length=300)
+        def fallback():
+            return catalog.get().profile_template.format(sign=zodiac, life_path=life_path)
         
-        if not ai_analysis:
-            ai_analysis = f"Вы {zodiac} с числом пути {life_path} - уникальное сочетание! 🌟 Ваша личность сочетает в себе качества знака и мудрость числа. Это делает вас особенным!"
+        def render(ai_analysis):
+            response = f'👤 Ваш профиль\n\n'
+            response += f'🌟 Знак: {zodiac}\n'
+            response += f'🔢 Число: {life_path}\n'
+            response += f'📅 Дата: {birth}\n\n'
+            response += f'{ai_analysis}\n\n'
+            response += '✨ Полный профиль с Луной и Асцендентом: /premium'
+            return response
         
-        response = f'👤 Ваш профиль\n\n'
-        response += f'🌟 Знак: {zodiac}\n'
-        response += f'🔢 Число: {life_path}\n'
-        response += f'📅 Дата: {date}\n\n'
-        response += f'{ai_analysis}\n\n'
-        response += '✨ Полный профиль с Луной и Асцендентом: /premium'
-        
-        send_message(chat_id, response)
+        await reply_with_feature(chat_id, render, fallback, 'profile', zodiac, life_path)
         
     except Exception as e:
-        send_message(chat_id, "❌ Неверный формат даты")
+        count_error('handler', e)
+        await send_message(chat_id, catalog.get().replies['error'])
 
-def handle_premium(chat_id):
+@track_handler
+async def handle_premium(chat_id):
     """Информация о Premium"""
-    response = (
-        '💎 AstroHarmony Premium\n\n'
-        '✨ Что включено:\n\n'
-        '📊 Полные детальные отчеты (в 3-5 раз больше информации)\n'
-        '🔮 Персональные прогнозы на месяц/год\n'
-        '💕 Детальная синастрия с домами и аспектами\n'
-        '🎴 Расклады Таро на 3/7/10 карт\n'
-        '📈 Транзиты и прогрессии\n'
-        '🌙 Анализ Луны, Асцендента и всех планет\n'
-        '⚡ Приоритетная поддержка\n'
-        '🚀 Без ограничений по запросам\n\n'
-        '💰 Цена: 990₽/месяц\n\n'
-        '📞 Для покупки напишите:\n'
-        '@astroharmony_support\n\n'
-        'Или отправьте /feedback'
-    )
-    send_message(chat_id, response)
+    await send_message(chat_id, catalog.get().replies['premium'])
 
-def handle_feedback(chat_id):
+@track_handler
+async def handle_feedback(chat_id):
     """Обратная связь"""
-    response = (
-        '💬 Обратная связь\n\n'
-        'Свяжитесь с нами для:\n'
-        '• Покупки Premium\n'
-        '• Вопросов и предложений\n'
-        '• Технической поддержки\n\n'
-        '📧 Email: support@astroharmony.com\n'
-        '💬 Telegram: @astroharmony_support\n\n'
-        'Мы ответим в течение 24 часов! 💫'
-    )
-    send_message(chat_id, response)
+    await send_message(chat_id, catalog.get().replies['feedback'])
+
+@track_handler
+async def handle_stop(chat_id):
+    """Отписка от ежедневной рассылки"""
+    if subscribers:
+        try:
+            subscribers.remove(chat_id)
+        except Exception as e:
+            logger.error(f"Error removing subscriber: {e}")
+    await send_message(chat_id, catalog.get().replies['stop'])
+
+@track_handler
+async def handle_unknown(chat_id):
+    """Ответ на непонятное сообщение"""
+    await send_message(chat_id, catalog.get().replies['unknown'])
+
+@track_handler
+async def handle_invalid_date(chat_id):
+    """Ответ не является существующей датой - вопрос остается в силе"""
+    await send_message(chat_id, catalog.get().replies['invalid_date'])
+
+@track_handler
+async def handle_invalid_pair(chat_id):
+    """Ответ не является парой существующих дат - вопрос остается в силе"""
+    await send_message(chat_id, catalog.get().replies['invalid_pair'])
 
-def process_message(message_text, chat_id):
+# Маршруты: команда, кнопка или ответ на вопрос бота -> обработчик
+router = Router()
+router.command('/start', handle_start)
+router.command('/help', handle_help)
+router.command('/compatibility', handle_compatibility_request)
+router.command('/numerology', handle_numerology)
+router.command('/astrology', handle_astrology)
+router.command('/synastry', handle_synastry)
+router.command('/life_path', handle_life_path)
+router.command('/tarot', handle_tarot)
+router.command('/profile', handle_profile)
+router.command('/premium', handle_premium)
+router.command('/feedback', handle_feedback)
+router.command('/stop', handle_stop)
+
+router.callback('compatibility', handle_compatibility_request)
+router.callback('numerology', handle_numerology)
+router.callback('astrology', handle_astrology)
+router.callback('premium', handle_premium)
+
+router.state('compatibility', parse_pair, handle_compatibility, handle_invalid_pair)
+router.state('numerology', parse_date, handle_numerology_analysis, handle_invalid_date)
+router.state('astrology', parse_date, handle_astrology_analysis, handle_invalid_date)
+router.state('synastry', parse_pair, handle_synastry_analysis, handle_invalid_pair)
+router.state('life_path', parse_date, handle_life_path_analysis, handle_invalid_date)
+router.state('profile', parse_date, handle_profile_analysis, handle_invalid_date)
+
+async def process_message(message_text, chat_id):
     """Основная обработка сообщений"""
     text = message_text.strip()
     
     # Команды
-    if text == '/start':
-        handle_start(chat_id)
-        return
-    elif text == '/help':
-        handle_help(chat_id)
-        return
-    elif text == '/compatibility':
-        handle_compatibility_request(chat_id)
-        return
-    elif text == '/numerology':
-        handle_numerology(chat_id)
-        return
-    elif text == '/astrology':
-        handle_astrology(chat_id)
-        return
-    elif text == '/synastry':
-        handle_synastry(chat_id)
-        return
-    elif text == '/life_path':
-        handle_life_path(chat_id)
-        return
-    elif text == '/tarot':
-        handle_tarot(chat_id)
-        return
-    elif text == '/profile':
-        handle_profile(chat_id)
-        return
-    elif text == '/premium':
-        handle_premium(chat_id)
-        return
-    elif text == '/feedback':
-        handle_feedback(chat_id)
+    handler = router.match_command(text)
+    if handler:
+        await handler(chat_id)
         return
     
     # Обработка ответов пользователя
-    if chat_id in user_data:
-        waiting_for = user_data[chat_id].get('waiting_for')
-        
-        if waiting_for == 'compatibility' and ' и ' in text.lower():
-            parts = re.split(r'\s+и\s+', text, flags=re.IGNORECASE)
-            if len(parts) == 2:
-                handle_compatibility(chat_id, parts[0], parts[1])
-                del user_data[chat_id]
-                return
-        
-        elif waiting_for == 'numerology' and len(text.split('.')) == 3:
-            handle_numerology_analysis(chat_id, text)
-            del user_data[chat_id]
-            return
-        
-        elif waiting_for == 'astrology' and len(text.split('.')) == 3:
-            handle_astrology_analysis(chat_id, text)
-            del user_data[chat_id]
-            return
-        
-        elif waiting_for == 'synastry' and ' и ' in text.lower():
-            parts = re.split(r'\s+и\s+', text, flags=re.IGNORECASE)
-            if len(parts) == 2:
-                handle_synastry_analysis(chat_id, parts[0], parts[1])
-                del user_data[chat_id]
-                return
-        
-        elif waiting_for == 'life_path' and len(text.split('.')) == 3:
-            handle_life_path_analysis(chat_id, text)
-            del user_data[chat_id]
-            return
-        
-        elif waiting_for == 'profile' and len(text.split('.')) == 3:
-            handle_profile_analysis(chat_id, text)
-            del user_data[chat_id]
+    waiting_for = user_data.get(chat_id)
+    if waiting_for:
+        route = router.match_state(waiting_for, text)
+        if route:
+            handler, args, finished = route
+            await handler(chat_id, *args)
+            if finished:
+                user_data.delete(chat_id)
             return
     
     # Если не подошло ни под что
-    response = (
-        '❓ Не понял команду.\n\n'
-        'Используйте /help для списка команд\n'
-        'или /start для главного меню'
-    )
-    send_message(chat_id, response)
+    await handle_unknown(chat_id)
+
+async def process_update(update):
+    """Обработка одного обновления Telegram"""
+    if update.message and update.message.text:
+        chat_id = update.message.chat_id
+        message_text = update.message.text
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Received: %s from %s", message_text, chat_id,
+                        extra={'chat_id': chat_id, 'update_id': update.update_id, 'sampled': True})
+        await process_message(message_text, chat_id)
+    
+    # Обработка callback кнопок
+    elif update.callback_query:
+        query = update.callback_query
+        handler = router.match_callback(query.data)
+        if handler:
+            await handler(query.message.chat_id)
+
+# Пул фоновых воркеров: webhook только ставит обновление в очередь.
+# Создается при первом обновлении, ASGI режим подставляет свой пул.
+update_pool = None
+update_pool_lock = threading.Lock()
+
+def get_update_pool():
+    """Пул воркеров для Flask режима (None - обработка прямо в webhook)"""
+    global update_pool
+    if UPDATE_WORKERS <= 0:
+        return None
+    with update_pool_lock:
+        if update_pool is None:
+            update_pool = UpdateWorkerPool(
+                lambda update: run_sync(process_update(update)),
+                workers=UPDATE_WORKERS,
+                maxsize=UPDATE_QUEUE_SIZE
+            )
+            update_pool.start()
+    return update_pool
+
+@atexit.register
+def shutdown():
+    """Обрабатывает оставшиеся обновления и останавливает event loop при выходе"""
+    # Асинхронный пул ASGI режима останавливается в lifespan
+    if update_pool and not isinstance(update_pool, AsyncUpdateWorkerPool):
+        update_pool.stop(SHUTDOWN_DRAIN_TIMEOUT)
+    if loop is None:
+        return
+    
+    async def cancel_tasks():
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    try:
+        asyncio.run_coroutine_threadsafe(cancel_tasks(), loop).result(5)
+    except Exception as e:
+        logger.error(f"Error stopping event loop: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+
+def get_stats():
+    """Метрики для /stats"""
+    return {
+        'update_queue': update_pool.get_stats() if update_pool else None,
+        'response_cache': response_cache.get_stats() if response_cache else None,
+        'corpus': corpus_store.get_stats() if corpus_store else None,
+        'gemini_flights': gemini_flights.get_stats(),
+        'gemini_breaker': gemini_breaker.get_stats(),
+        'pending_states': user_data.count_by_state(),
+        'send_queue': outbox.get_stats() if outbox else None,
+        'seen_updates': seen_updates.get_stats() if seen_updates else None,
+        'birth_dates': get_birth_date_stats(),
+        'content': catalog.get_stats(),
+        'admission': admission.get_stats() if admission else None,
+        'logging': get_logging_stats(),
+    }
 
 # Webhook endpoint
 @app.route(f'/{TOKEN}', methods=['POST'])
@@ -690,29 +990,25 @@ def webhook():
         json_data = request.get_json()
         update = Update.de_json(json_data, bot)
         
-        if update.message and update.message.text:
-            chat_id = update.message.chat_id
-            message_text = update.message.text
-            logger.info(f"Received: {message_text} from {chat_id}")
-            process_message(message_text, chat_id)
+        if seen_updates and seen_updates.check_and_add(update.update_id):
+            # Повторная доставка - уже обработано или обрабатывается
+            logger.info(f"Duplicate update {update.update_id} ignored")
+            return 'ok'
         
-        # Обработка callback кнопок
-        elif update.callback_query:
-            query = update.callback_query
-            chat_id = query.message.chat_id
-            data = query.data
-            
-            if data == 'compatibility':
-                handle_compatibility_request(chat_id)
-            elif data == 'numerology':
-                handle_numerology(chat_id)
-            elif data == 'astrology':
-                handle_astrology(chat_id)
-            elif data == 'premium':
-                handle_premium(chat_id)
+        pool = get_update_pool()
+        if pool:
+            if not pool.submit(update, key=update.effective_chat.id if update.effective_chat else None):
+                # Очередь переполнена - Telegram повторит доставку позже
+                logger.warning(f"Update queue full, rejecting update {update.update_id}")
+                if seen_updates:
+                    seen_updates.discard(update.update_id)
+                return 'busy', 503
+            return 'ok'
         
+        run_sync(process_update(update))
         return 'ok'
     except Exception as e:
+        count_error('webhook', e)
         logger.error(f"Error: {e}")
         return 'ok'
 
@@ -724,6 +1020,39 @@ def index():
 def health():
     return 'OK'
 
+def collect_gauges():
+    """Состояние компонентов для /metrics"""
+    all_stats = get_stats()
+    pending = {(('state', state),): count for state, count in all_stats['pending_states'].items()}
+    components = {}
+    for component, stats in all_stats.items():
+        if component == 'pending_states':
+            continue
+        for stat, value in (stats or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                components[(('component', component), ('stat', stat))] = value
+    # Все состояния в каждом ответе: иначе серия прежнего состояния
+    # остается в Prometheus со значением 1 еще 5 минут (staleness)
+    current = all_stats['gemini_breaker']['state']
+    breaker = {(('state', state),): int(state == current) for state in (CLOSED, OPEN, HALF_OPEN)}
+    return [
+        ('astro_pending_states', 'Conversations waiting for user input', pending),
+        ('astro_component_stat', 'Internal component counters and gauges (see /stats)', components),
+        ('astro_gemini_breaker_state', 'Current Gemini circuit breaker state', breaker),
+    ]
+
+metrics.add_collector(collect_gauges)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики в формате Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stats')
+def stats():
+    """Метрики очереди и кеша"""
+    return jsonify(get_stats())
+
 @app.route('/set_webhook')
 def set_webhook():
     """Установка webhook"""
@@ -733,7 +1062,7 @@ def set_webhook():
             
             @run_async
             async def set_wh():
-                await bot.set_webhook(url=webhook_url)
+                await admin_bot.set_webhook(url=webhook_url)
             
             set_wh()
             logger.info(f"Webhook set to {webhook_url}")
@@ -0,0 +1,122 @@
+"""Рассылка ежедневного прогноза всем подписчикам
+
+Запуск: python broadcast.py [--run-id daily-2024-01-31] [--chunk-size 1000] [--concurrency 100] [--rate 10]
+Повторный запуск с тем же run-id продолжает прерванную рассылку. Прогресс
+сохраняется каждые --checkpoint-every отправок, поэтому после сбоя
+повторно получат сообщение не больше нескольких сотен подписчиков.
+
+Рассылка и работающий бот делят один лимит Telegram (около 30 сообщений
+в секунду на бота), но считают его независимо. Поэтому рассылка идет со
+своим лимитом --rate, заметно меньше SEND_GLOBAL_RATE бота: сумма обоих
+должна оставаться в пределах лимита Telegram.
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import date
+
+from telegram.error import BadRequest, Forbidden
+
+import bot as astro
+from send_queue import SendDispatcher
+
+logger = logging.getLogger(__name__)
+
+
+async def render_messages():
+    """Текст рассылки для каждого знака - один раз на знак, а не на пользователя"""
+    messages = {}
+    for zodiac in astro.ZODIAC_SIGNS:
+        forecast = await astro.get_forecast(zodiac)
+        messages[zodiac] = (
+            f'🔮 Прогноз на сегодня\n\n'
+            f'🌟 Знак: {zodiac}\n\n'
+            f'{forecast}\n\n'
+            f'✨ Детальный прогноз на месяц/год: /premium\n'
+            f'🔕 Отписаться от рассылки: /stop'
+        )
+    return messages
+
+
+async def run_broadcast(store, run_id, chunk_size=1000, concurrency=100, checkpoint_every=100):
+    """Отправляет прогноз подписчикам пачками, сохраняя прогресс каждые checkpoint_every отправок"""
+    progress = store.load_run(run_id)
+    if progress and progress[3]:
+        logger.info(f"Broadcast {run_id} already finished: {progress[1]} sent, {progress[2]} failed")
+        return
+    last_chat_id, sent, failed = progress[:3] if progress else (0, 0, 0)
+    if progress:
+        logger.info(f"Resuming broadcast {run_id} after chat {last_chat_id}")
+
+    messages = await render_messages()
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.monotonic()
+    run_sent = 0
+
+    async def deliver(chat_id, sign):
+        async with semaphore:
+            try:
+                await astro.send_message(chat_id, messages[sign])
+                return True
+            except Forbidden:
+                # Пользователь заблокировал бота
+                store.remove(chat_id)
+            except BadRequest as e:
+                logger.warning(f"Broadcast to {chat_id} failed: {e}")
+            except Exception as e:
+                logger.error(f"Broadcast to {chat_id} failed: {e}")
+            return False
+
+    unsaved = 0
+    for chunk in store.iter_chunks(last_chat_id, chunk_size):
+        tasks = [asyncio.ensure_future(deliver(chat_id, sign)) for chat_id, sign in chunk]
+        # Отправки идут параллельно, а результаты забираются по порядку
+        # chat_id: last_chat_id - последний чат, до которого все уже обработано
+        for (chat_id, _), task in zip(chunk, tasks):
+            if await task:
+                sent += 1
+                run_sent += 1
+            else:
+                failed += 1
+            last_chat_id = chat_id
+            unsaved += 1
+            if unsaved >= checkpoint_every:
+                store.save_run(run_id, last_chat_id, sent, failed)
+                unsaved = 0
+        store.save_run(run_id, last_chat_id, sent, failed)
+        unsaved = 0
+        elapsed = time.monotonic() - started
+        logger.info(f"Broadcast {run_id}: {sent} sent, {failed} failed, {run_sent / elapsed:.1f} msg/s")
+
+    store.save_run(run_id, last_chat_id, sent, failed, finished=True)
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"Broadcast {run_id} finished: {sent} sent, {failed} failed in {elapsed:.1f}s "
+        f"({run_sent / elapsed if elapsed else 0:.1f} msg/s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send the daily forecast to all subscribers')
+    parser.add_argument('--run-id', default=f'daily-{date.today().isoformat()}', help='checkpoint name')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='subscribers loaded per batch')
+    parser.add_argument('--concurrency', type=int, default=100, help='sends in flight')
+    parser.add_argument('--checkpoint-every', type=int, default=100, help='sends between progress saves')
+    parser.add_argument('--rate', type=float, default=10,
+                        help='messages per second; shares the Telegram limit with the running bot')
+    args = parser.parse_args()
+
+    if not astro.subscribers:
+        raise SystemExit('SUBSCRIBERS_DB is not set')
+    # Вместо SEND_GLOBAL_RATE бота - лимит рассылки, даже при SEND_RATE_LIMIT=0
+    astro.outbox = SendDispatcher(
+        args.rate, astro.SEND_CHAT_RATE, astro.SEND_CHAT_BURST,
+        astro.SEND_MAX_PENDING, astro.SEND_CONCURRENCY, astro.SEND_MAX_RETRIES
+    )
+    logger.info(f"Broadcasting to {astro.subscribers.count()} subscribers")
+    asyncio.run(run_broadcast(astro.subscribers, args.run_id, args.chunk_size, args.concurrency, args.checkpoint_every))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Автомат отключения внешнего сервиса после серии ошибок
+
+    closed - запросы идут как обычно; после failure_threshold ошибок или
+    медленных вызовов подряд переходит в open. open - запросы пропускаются
+    reset_timeout секунд. half_open - пропускается один пробный запрос:
+    успех закрывает автомат, ошибка снова открывает.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, slow_call_threshold=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_threshold = slow_call_threshold
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probe_in_flight = False
+        self.stats = {'successes': 0, 'failures': 0, 'slow_calls': 0, 'rejected': 0, 'opened': 0}
+
+    def allow(self):
+        """Можно ли сейчас обращаться к сервису"""
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.stats['rejected'] += 1
+                    return False
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self.probe_in_flight:
+                    self.stats['rejected'] += 1
+                    return False
+                self.probe_in_flight = True
+            return True
+
+    def record_success(self, duration=None):
+        """Успешный вызов; слишком медленный считается ошибкой"""
+        if self.slow_call_threshold and duration is not None and duration > self.slow_call_threshold:
+            with self.lock:
+                self.stats['slow_calls'] += 1
+            self.record_failure()
+            return
+        with self.lock:
+            self.stats['successes'] += 1
+            self.failures = 0
+            self.probe_in_flight = False
+            self.state = CLOSED
+
+    def record_failure(self):
+        with self.lock:
+            self.stats['failures'] += 1
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.stats['opened'] += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['state'] = self.state
+            stats['consecutive_failures'] = self.failures
+        return stats
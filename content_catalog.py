@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+# Тексты ответов из content.json; словари - только для чтения, списки - кортежи
+Content = namedtuple('Content', [
+    'replies',                   # готовые ответы: команды, вопросы, ошибки
+    'start_keyboard',            # InlineKeyboardMarkup главного меню
+    'tarot',                     # готовые ответы для каждой карты
+    'forecasts', 'forecast_default',
+    'numerology', 'numerology_default',
+    'life_path', 'life_path_default',
+    'compatibility_templates',   # с {sign1} и {sign2}
+    'synastry_template',         # с {sign1} и {sign2}
+    'profile_template',          # с {sign} и {life_path}
+])
+
+REQUIRED_REPLIES = (
+    'start', 'help', 'premium', 'feedback', 'stop', 'unknown', 'error', 'invalid_date', 'invalid_pair',
+    'compatibility', 'numerology', 'astrology', 'synastry', 'life_path', 'profile',
+)
+
+
+def freeze(mapping):
+    return MappingProxyType(dict(mapping))
+
+
+def build_content(data):
+    """Content из разобранного JSON; KeyError/ValueError при ошибке в файле"""
+    replies = data['replies']
+    missing = [key for key in REQUIRED_REPLIES if key not in replies]
+    if missing:
+        raise KeyError(f"missing replies: {', '.join(missing)}")
+
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton(button['text'], callback_data=button['callback_data']) for button in row]
+        for row in data['start_keyboard']
+    ])
+    # Шаблоны подставляются заранее: ошибка в шаблоне видна при загрузке, а не в ответе
+    tarot = data['tarot']
+    tarot_replies = tuple(tarot['template'].format(name=name, meaning=meaning) for name, meaning in tarot['cards'])
+    if not tarot_replies:
+        raise ValueError('no tarot cards')
+    templates = tuple(data['compatibility']['templates'])
+    if not templates:
+        raise ValueError('no compatibility templates')
+    for template in templates + (data['synastry']['template'],):
+        template.format(sign1='', sign2='')
+    data['profile']['template'].format(sign='', life_path='')
+
+    return Content(
+        replies=freeze(replies),
+        start_keyboard=keyboard,
+        tarot=tarot_replies,
+        forecasts=freeze(data['forecasts']['signs']),
+        forecast_default=data['forecasts']['default'],
+        numerology=freeze({int(number): text for number, text in data['numerology']['numbers'].items()}),
+        numerology_default=data['numerology']['default'],
+        life_path=freeze({int(number): text for number, text in data['life_path']['numbers'].items()}),
+        life_path_default=data['life_path']['default'],
+        compatibility_templates=templates,
+        synastry_template=data['synastry']['template'],
+        profile_template=data['profile']['template'],
+    )
+
+
+class ContentCatalog:
+    """Тексты бота из JSON файла с перечитыванием при изменении
+
+    Файл проверяется не чаще раза в check_interval секунд. Обработчики
+    получают неизменяемый снимок (Content), поэтому перезагрузка не
+    меняет ответ на середине. Если новая версия файла с ошибкой, остается
+    прежняя; без первой успешной загрузки бот не запускается.
+    """
+
+    def __init__(self, path, check_interval=60):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.mtime = os.path.getmtime(path)
+        self.content = self._load()
+        self.checked_at = time.monotonic()
+        self.stats = {'reloads': 0, 'errors': 0}
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            return build_content(json.load(f))
+
+    def _refresh(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.checked_at < self.check_interval:
+                return
+            self.checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+                if mtime == self.mtime:
+                    return
+                self.mtime = mtime
+                self.content = self._load()
+                self.stats['reloads'] += 1
+                logger.info(f"Reloaded content from {self.path}")
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Error reloading content {self.path}, keeping previous version: {e}")
+
+    def get(self):
+        """Текущий снимок текстов"""
+        if self.check_interval >= 0 and time.monotonic() - self.checked_at >= self.check_interval:
+            self._refresh()
+        return self.content
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
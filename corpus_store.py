@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(cache_key):
+    """Строковый ключ корпуса из (функция, входные данные)"""
+    return '|'.join(str(part) for part in cache_key)
+
+
+class CorpusStore:
+    """Заранее сгенерированные тексты на день: corpus/ГГГГ-ММ-ДД.json
+
+    Файл пишется отдельным процессом (pregenerate.py), поэтому бот
+    перечитывает его при смене даты или изменении файла.
+    """
+
+    def __init__(self, directory, check_interval=60):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.day = None
+        self.mtime = None
+        self.checked_at = 0
+        self.texts = {}
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def path_for(self, day):
+        return os.path.join(self.directory, f'{day.isoformat()}.json')
+
+    def _refresh(self):
+        now = time.monotonic()
+        today = date.today()
+        if today == self.day and now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        path = self.path_for(today)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            self.day, self.mtime, self.texts = today, None, {}
+            return
+        if today == self.day and mtime == self.mtime:
+            return
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.texts = json.load(f)['texts']
+            self.day, self.mtime = today, mtime
+            logger.info(f"Loaded {len(self.texts)} pregenerated texts from {path}")
+        except Exception as e:
+            logger.error(f"Error loading corpus {path}: {e}")
+            self.day, self.mtime, self.texts = today, None, {}
+
+    def get(self, cache_key):
+        """Текст из корпуса на сегодня или None"""
+        with self.lock:
+            self._refresh()
+            variants = self.texts.get(make_key(cache_key))
+            if variants:
+                self.stats['hits'] += 1
+                return random.choice(variants)
+            self.stats['misses'] += 1
+            return None
+
+    def save(self, day, texts):
+        """Атомарно записывает корпус на день: {ключ: [варианты]}"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(day)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'date': day.isoformat(), 'texts': texts}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return path
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.texts)
+            stats['day'] = self.day.isoformat() if self.day else None
+        return stats
@@ -0,0 +1,28 @@
+"""Настройки gunicorn, читаются автоматически при запуске из этого каталога
+
+    gunicorn bot:app
+    GUNICORN_PRELOAD=1 gunicorn bot:app --workers 4    # или gunicorn --preload
+
+С preload bot.py импортируется один раз в мастере, воркеры получают уже
+загруженные модули через fork и делят их память (copy-on-write) вместо
+того, чтобы каждый импортировал SDK заново.
+"""
+import gc
+import os
+import sys
+
+preload_app = os.getenv('GUNICORN_PRELOAD', '0') == '1'
+
+
+def pre_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    # Фоновая инициализация Gemini держит model_lock и блокировку импорта:
+    # fork посреди нее оставил бы воркеру захваченные блокировки
+    bot = sys.modules.get('bot')
+    thread = getattr(bot, 'model_thread', None)
+    if thread is not None:
+        thread.join()
+    # Объекты мастера переносятся в постоянное поколение: сборщик мусора
+    # воркера не трогает их заголовки, и страницы остаются общими
+    gc.freeze()
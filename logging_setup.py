@@ -0,0 +1,136 @@
+"""Настройка логирования: текст или JSON, запись в фоновом потоке, сэмплирование
+
+Частые INFO записи (каждое сообщение, каждый обработчик) помечаются
+extra={'sampled': True} и сохраняются с долей sample_rate. В режиме
+очереди поток запроса только кладет запись в очередь: форматирование
+(включая %-аргументы) и запись в stderr выполняет фоновый поток.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Атрибуты LogRecord; остальные поля записи пришли через extra
+RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sampled'}
+
+listener = None
+log_queue = None
+stats = {'dropped': 0, 'sampled_out': 0}
+stats_lock = threading.Lock()
+
+
+def count(name):
+    with stats_lock:
+        stats[name] += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON строка на запись: время, уровень, логгер, сообщение и поля extra"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Пропускает долю rate записей с extra={'sampled': True} уровня INFO и ниже"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno > logging.INFO or not getattr(record, 'sampled', False):
+            return True
+        if random.random() < self.rate:
+            return True
+        count('sampled_out')
+        return False
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler без форматирования в потоке запроса
+
+    Стандартный prepare() форматирует сообщение до постановки в очередь;
+    здесь запись уходит как есть, форматирует ее поток QueueListener.
+    При переполненной очереди запись отбрасывается, а не блокирует запрос.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            count('dropped')
+
+
+def setup_logging(fmt='text', use_queue=False, level='INFO', sample_rate=1.0, queue_size=10000):
+    """Настраивает корневой логгер; повторный вызов ничего не меняет"""
+    global listener, log_queue
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+    root.setLevel(level)
+
+    if not use_queue:
+        stream.addFilter(SampleFilter(sample_rate))
+        root.addHandler(stream)
+        return
+
+    log_queue = queue.Queue(queue_size)
+    handler = LazyQueueHandler(log_queue)
+    handler.addFilter(SampleFilter(sample_rate))
+    root.addHandler(handler)
+    listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    # Регистрируется раньше остальных atexit обработчиков, значит выполняется
+    # после них: их последние записи тоже будут записаны
+    atexit.register(listener.stop)
+    os.register_at_fork(after_in_child=restart_listener)
+
+
+def restart_listener():
+    """Новая очередь и поток записи в процессе после fork
+
+    Поток QueueListener остается в родителе: без этого воркеры gunicorn
+    --preload складывали бы записи в очередь, которую никто не читает.
+    """
+    global listener, log_queue
+    handlers = listener.handlers
+    log_queue = queue.Queue(log_queue.maxsize)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, LazyQueueHandler):
+            handler.queue = log_queue
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def get_stats():
+    """Отброшенные записи для /stats"""
+    with stats_lock:
+        result = dict(stats)
+    result['queued'] = log_queue.qsize() if log_queue else None
+    return result
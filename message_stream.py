@@ -0,0 +1,80 @@
+import asyncio
+import logging
+
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+
+class MessageStream:
+    """Сообщение, которое дописывается по мере генерации текста
+
+    Первый update() отправляет сообщение, следующие правят его не чаще
+    раза в interval секунд. Промежуточные тексты, пришедшие между правками,
+    пропускаются - показывается только последний.
+
+    send(text) - корутина, возвращающая отправленное сообщение;
+    edit(message_id, text) - корутина правки сообщения.
+    """
+
+    def __init__(self, send, edit, interval=1.0):
+        self.send = send
+        self.edit = edit
+        self.interval = interval
+        self.message_id = None
+        self.latest = None
+        self.shown = None
+        self.closed = False
+        self.changed = asyncio.Event()
+        self.task = None
+        self.edits = 0
+
+    @property
+    def started(self):
+        return self.task is not None
+
+    def update(self, text):
+        """Новый текст сообщения (не блокирует генерацию)"""
+        if self.closed:
+            return
+        self.latest = text
+        self.changed.set()
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._pump())
+
+    async def finish(self, text):
+        """Итоговый текст: дожидается очередной правки и показывает его"""
+        self.latest = text
+        self.closed = True
+        self.changed.set()
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._pump())
+        await self.task
+
+    async def _pump(self):
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+            closed = self.closed
+            if self.latest != self.shown:
+                await self._show(self.latest)
+            if closed:
+                # Итоговый текст показан (или попытка не удалась) - больше правок не будет
+                return
+            await asyncio.sleep(self.interval)
+
+    async def _show(self, text):
+        try:
+            if self.message_id is None:
+                message = await self.send(text)
+                self.message_id = message.message_id
+            else:
+                await self.edit(self.message_id, text)
+                self.edits += 1
+            self.shown = text
+        except BadRequest as e:
+            # "message is not modified" и подобное - текст уже на экране
+            logger.warning(f"Stream edit rejected: {e}")
+            self.shown = text
+        except Exception as e:
+            logger.error(f"Stream update failed: {e}")
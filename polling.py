@@ -0,0 +1,134 @@
+"""Получение обновлений через getUpdates вместо webhook
+
+Запуск: python polling.py [--limit 100] [--timeout 30] [--concurrency 100]
+Не требует публичного HTTPS адреса; установленный webhook удаляется при
+запуске. Offset сдвигается только после обработки всей пачки, поэтому
+при падении необработанные обновления будут получены снова.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+import time
+
+from telegram.error import Conflict, NetworkError, RetryAfter, TimedOut
+
+import bot as astro
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_UPDATES = ['message', 'callback_query']
+
+
+def group_by_chat(updates):
+    """Обновления пачки по чатам с сохранением порядка внутри чата"""
+    groups = {}
+    for update in updates:
+        key = update.effective_chat.id if update.effective_chat else update.update_id
+        groups.setdefault(key, []).append(update)
+    return list(groups.values())
+
+
+async def process_batch(updates, semaphore):
+    """Чаты обрабатываются параллельно, сообщения одного чата - по очереди"""
+    async def process_chat(chat_updates):
+        async with semaphore:
+            # seen_updates здесь не нужен: offset подтверждает только
+            # обработанную пачку, а пометка до обработки потеряла бы
+            # обновление, прерванное падением
+            for update in chat_updates:
+                try:
+                    await astro.process_update(update)
+                except Exception as e:
+                    astro.count_error('polling', e)
+                    logger.error(f"Error processing update {update.update_id}: {e}")
+
+    await asyncio.gather(*(process_chat(group) for group in group_by_chat(updates)))
+
+
+async def run_polling(stopping, limit=100, timeout=30, concurrency=100, stats_interval=60):
+    """Цикл long polling, пока не установлено событие stopping"""
+    await astro.admin_bot.delete_webhook()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    offset = None
+    processed = 0
+    backoff = 1
+    last_report = time.monotonic()
+    logger.info(f"Polling for updates (limit {limit}, timeout {timeout}s)")
+    stop_wait = asyncio.ensure_future(stopping.wait())
+
+    while not stopping.is_set():
+        fetch = asyncio.ensure_future(astro.bot.get_updates(
+            offset=offset, limit=limit, timeout=timeout, allowed_updates=ALLOWED_UPDATES
+        ))
+        await asyncio.wait([fetch, stop_wait], return_when=asyncio.FIRST_COMPLETED)
+        if not fetch.done():
+            # Остановка во время ожидания - ничего не получено
+            fetch.cancel()
+            break
+        try:
+            updates = fetch.result()
+            backoff = 1
+        except RetryAfter as e:
+            logger.warning(f"getUpdates flood control, retry in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+            continue
+        except Conflict as e:
+            logger.error(f"getUpdates conflict (another poller or webhook is active): {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        except (NetworkError, TimedOut) as e:
+            logger.warning(f"getUpdates failed: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        except Exception as e:
+            astro.count_error('polling', e)
+            logger.error(f"getUpdates error: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+
+        if updates:
+            await process_batch(updates, semaphore)
+            # Следующий getUpdates с этим offset подтверждает обработанную пачку
+            offset = updates[-1].update_id + 1
+            processed += len(updates)
+
+        now = time.monotonic()
+        if now - last_report >= stats_interval:
+            logger.info(f"Polling: {processed} updates, {processed / (now - last_report):.1f}/s")
+            processed = 0
+            last_report = now
+
+    stop_wait.cancel()
+    if offset is not None:
+        # Подтверждаем последнюю пачку, чтобы после перезапуска она не пришла снова
+        try:
+            await astro.bot.get_updates(offset=offset, limit=1, timeout=0, allowed_updates=ALLOWED_UPDATES)
+        except Exception as e:
+            logger.error(f"Error committing offset {offset}: {e}")
+    logger.info("Polling stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the bot with getUpdates long polling')
+    parser.add_argument('--limit', type=int, default=100, help='updates per batch (1-100)')
+    parser.add_argument('--timeout', type=int, default=30, help='long polling timeout in seconds')
+    parser.add_argument('--concurrency', type=int, default=100, help='chats processed in parallel')
+    args = parser.parse_args()
+
+    async def serve():
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopping.set)
+        await run_polling(stopping, args.limit, args.timeout, args.concurrency)
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
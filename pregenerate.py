@@ -0,0 +1,120 @@
+"""Заранее генерирует все AI тексты бота на день
+
+Разовый запуск:    python pregenerate.py [--date 2024-01-31] [--concurrency 5] [--retries 3]
+Планировщик:       python pregenerate.py --daemon --at 03:00
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import date, datetime, timedelta
+
+import bot as astro
+from corpus_store import CorpusStore, make_key
+
+logger = logging.getLogger(__name__)
+
+
+async def generate_corpus(concurrency=5, variants=1, retries=3, retry_delay=30):
+    """Генерирует тексты для всех функций и входных данных
+
+    Ключи, для которых не получено variants текстов, генерируются повторно
+    через retry_delay, 2 * retry_delay, ... секунд. Общий circuit breaker
+    бота не используется: после серии ошибок он отклонил бы все оставшиеся
+    запросы пакета без обращения к Gemini.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    texts = {}
+    failed = 0
+
+    async def generate_one(feature, inputs):
+        nonlocal failed
+        build_prompt, max_length = astro.AI_FEATURES[feature]
+        key = make_key((feature,) + inputs)
+        for _ in range(variants - len(texts.get(key, ()))):
+            async with semaphore:
+                text = await astro.generate_text(build_prompt(*inputs), max_length, use_breaker=False)
+            if text:
+                texts.setdefault(key, []).append(text)
+            else:
+                failed += 1
+
+    jobs = [(feature, inputs) for feature in astro.AI_FEATURES for inputs in astro.iter_feature_inputs(feature)]
+    logger.info(f"Generating {len(jobs) * variants} texts with concurrency {concurrency}")
+    for attempt in range(retries + 1):
+        if attempt:
+            delay = retry_delay * 2 ** (attempt - 1)
+            logger.warning(f"{len(jobs)} keys incomplete, retry {attempt}/{retries} in {delay:.0f}s")
+            await asyncio.sleep(delay)
+        await asyncio.gather(*(generate_one(feature, inputs) for feature, inputs in jobs))
+        jobs = [
+            (feature, inputs) for feature, inputs in jobs
+            if len(texts.get(make_key((feature,) + inputs), ())) < variants
+        ]
+        if not jobs:
+            break
+    return texts, failed, len(jobs)
+
+
+async def pregenerate(day, concurrency=5, variants=1, retries=3, retry_delay=30):
+    """Генерирует и сохраняет корпус на день; возвращает число неполных ключей"""
+    started = time.monotonic()
+    texts, failed, missing = await generate_corpus(concurrency, variants, retries, retry_delay)
+    path = CorpusStore(astro.CORPUS_DIR).save(day, texts)
+    logger.info(
+        f"Saved {len(texts)} keys to {path} in {time.monotonic() - started:.1f}s "
+        f"({failed} failed)"
+    )
+    if missing:
+        logger.warning(f"{missing} keys incomplete after {retries} retries, they fall back to live Gemini calls")
+    return missing
+
+
+def seconds_until(at):
+    """Секунды до ближайшего наступления времени ЧЧ:ММ"""
+    hour, minute = map(int, at.split(':'))
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+async def run_daemon(at, concurrency=5, variants=1, retries=3, retry_delay=30):
+    """Ежедневная генерация в одном event loop (клиент Gemini привязан к нему)"""
+    while True:
+        delay = seconds_until(at)
+        logger.info(f"Next pregeneration in {delay / 3600:.1f}h")
+        await asyncio.sleep(delay)
+        # Запуск после полудня готовит корпус на завтра
+        day = date.today() if datetime.now().hour < 12 else date.today() + timedelta(days=1)
+        try:
+            await pregenerate(day, concurrency, variants, retries, retry_delay)
+        except Exception as e:
+            logger.error(f"Pregeneration failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pregenerate daily AI texts')
+    parser.add_argument('--date', help='day to generate for, YYYY-MM-DD (default: today)')
+    parser.add_argument('--concurrency', type=int, default=5, help='parallel Gemini requests')
+    parser.add_argument('--variants', type=int, default=1, help='texts per key')
+    parser.add_argument('--daemon', action='store_true', help='run every day at --at')
+    parser.add_argument('--at', default='03:00', help='daily run time HH:MM (with --daemon)')
+    parser.add_argument('--retries', type=int, default=3, help='extra rounds for keys that failed')
+    parser.add_argument('--retry-delay', type=float, default=30, help='seconds before the first retry, doubled each round')
+    args = parser.parse_args()
+
+    if astro.get_model() is None:
+        raise SystemExit('Gemini is not configured')
+
+    if args.daemon:
+        asyncio.run(run_daemon(args.at, args.concurrency, args.variants, args.retries, args.retry_delay))
+    else:
+        day = date.fromisoformat(args.date) if args.date else date.today()
+        if asyncio.run(pregenerate(day, args.concurrency, args.variants, args.retries, args.retry_delay)):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import time
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity в запасе"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity=None, now=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = now if now is not None else time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now=None):
+        """Через сколько секунд будет доступен токен (0 - уже доступен)"""
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now=None):
+        """Забирает токен, если он есть"""
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def is_full(self, now=None):
+        """Бакет полностью восстановился - его можно не хранить"""
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    @staticmethod
+    def prune(buckets, now=None, keep=()):
+        """Удаляет из словаря buckets полностью восстановившиеся бакеты
+
+        Такой бакет неотличим от нового, поэтому хранить его незачем.
+        Ключи из keep не удаляются. Возвращает число удаленных.
+        """
+        now = now if now is not None else time.monotonic()
+        stale = [key for key, bucket in buckets.items() if key not in keep and bucket.is_full(now)]
+        for key in stale:
+            del buckets[key]
+        return len(stale)
@@ -0,0 +1,222 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from corpus_store import make_key
+from sqlite_db import SqliteConnections
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """LRU кеш сгенерированных текстов с TTL и несколькими вариантами на ключ
+
+    Пока для ключа накоплено меньше `variants` текстов, get() возвращает
+    промах - так ответы остаются разнообразными, а после заполнения
+    выдается случайный из сохраненных вариантов.
+    """
+
+    # Методы не блокируют: из event loop их можно вызывать напрямую
+    blocking = False
+
+    def __init__(self, max_entries=2000, variants=3, ttl=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.variants = variants
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+    def get(self, key):
+        """Возвращает закешированный текст или None"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self.entries[key]
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None or len(entry[1]) < self.variants:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return random.choice(entry[1])
+
+    def get_any(self, key):
+        """Любой живой вариант для ключа, даже если их меньше variants"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.time() or not entry[1]:
+                return None
+            return random.choice(entry[1])
+
+    def put(self, key, text, ttl=None):
+        """Сохраняет вариант текста для ключа"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= now:
+                entry = (now + (ttl if ttl is not None else self.ttl), [])
+                self.entries[key] = entry
+            texts = entry[1]
+            if len(texts) >= self.variants:
+                texts.pop(0)
+            texts.append(text)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        """Счетчики попаданий и промахов"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.entries)
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 3) if total else 0.0
+        return stats
+
+
+class SqliteResponseCache:
+    """Кеш сгенерированных текстов в SQLite (WAL), общий для воркеров хоста
+
+    Переживает перезапуски: после деплоя ответы берутся из файла, а не
+    заново из Gemini. Семантика та же, что у ResponseCache: промах, пока
+    для ключа меньше `variants` живых текстов. Читатели не блокируют друг
+    друга, страницы файла читаются через mmap. Раз в purge_interval секунд
+    фоновый поток со своим соединением удаляет просроченные тексты и самые
+    старые сверх max_entries ключей.
+    """
+
+    # Запросы ждут блокировок SQLite до 5 секунд: из event loop вызывать
+    # через asyncio.to_thread
+    blocking = True
+
+    def __init__(self, path='cache.db', max_entries=2000, variants=3, ttl=7 * 24 * 3600,
+                 purge_interval=300, mmap_size=64 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.variants = variants
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.mmap_size = mmap_size
+        self.purger_pid = None
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+        self.db = SqliteConnections(
+            path,
+            (
+                'CREATE TABLE IF NOT EXISTS response_cache ('
+                'key TEXT NOT NULL, text TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)',
+                'CREATE INDEX IF NOT EXISTS response_cache_key ON response_cache (key, expires_at)',
+                'CREATE INDEX IF NOT EXISTS response_cache_created ON response_cache (created_at)',
+            ),
+            # auto_vacuum действует только для нового файла, до создания таблиц
+            init_pragmas=('PRAGMA auto_vacuum=INCREMENTAL',),
+            pragmas=(f'PRAGMA mmap_size={int(mmap_size)}',),
+        )
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def get(self, key):
+        """Возвращает закешированный текст или None"""
+        rows = self.db.get().execute(
+            'SELECT text FROM response_cache WHERE key = ? AND expires_at > ?',
+            (make_key(key), time.time())
+        ).fetchall()
+        if len(rows) < self.variants:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return random.choice(rows)[0]
+
+    def get_any(self, key):
+        """Любой живой вариант для ключа, даже если их меньше variants"""
+        row = self.db.get().execute(
+            'SELECT text FROM response_cache WHERE key = ? AND expires_at > ? ORDER BY RANDOM() LIMIT 1',
+            (make_key(key), time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, text, ttl=None):
+        """Сохраняет вариант текста для ключа, вытесняя самый старый"""
+        now = time.time()
+        key = make_key(key)
+        conn = self.db.get()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT INTO response_cache (key, text, created_at, expires_at) VALUES (?, ?, ?, ?)',
+                (key, text, now, now + (ttl if ttl is not None else self.ttl))
+            )
+            conn.execute(
+                'DELETE FROM response_cache WHERE rowid IN ('
+                'SELECT rowid FROM response_cache WHERE key = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                (key, self.variants)
+            )
+        self._ensure_purger()
+
+    def _ensure_purger(self):
+        # Поток запускается в процессе, который пишет в кеш: воркеру
+        # gunicorn --preload поток мастера через fork не достается
+        pid = os.getpid()
+        if self.purger_pid == pid:
+            return
+        with self.lock:
+            if self.purger_pid == pid:
+                return
+            self.purger_pid = pid
+        threading.Thread(target=self._purge_loop, name='cache-purge', daemon=True).start()
+
+    def _purge_loop(self):
+        conn = self.db.open()
+        while True:
+            time.sleep(self.purge_interval)
+            try:
+                self.purge(conn)
+            except Exception as e:
+                logger.error(f"Error purging response cache: {e}")
+
+    def purge(self, conn=None):
+        """Удаляет просроченные тексты и самые старые ключи сверх max_entries"""
+        conn = conn or self.db.get()
+        expired = conn.execute('DELETE FROM response_cache WHERE expires_at <= ?', (time.time(),)).rowcount
+        evicted = conn.execute(
+            'DELETE FROM response_cache WHERE key IN ('
+            'SELECT key FROM response_cache GROUP BY key ORDER BY MAX(created_at) DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        ).rowcount
+        conn.execute('PRAGMA incremental_vacuum')
+        self._count('expired', expired)
+        self._count('evictions', evicted)
+
+    def clear(self):
+        self.db.get().execute('DELETE FROM response_cache')
+
+    def get_stats(self):
+        """Счетчики попаданий и промахов этого процесса и размер кеша"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats['size'] = self.db.get().execute('SELECT COUNT(DISTINCT key) FROM response_cache').fetchone()[0]
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 3) if total else 0.0
+        return stats
+
+
+def create_response_cache(backend='memory', path='cache.db', max_entries=2000, variants=3, ttl=7 * 24 * 3600):
+    """Кеш текстов по имени бэкенда: memory или sqlite"""
+    if backend == 'sqlite':
+        return SqliteResponseCache(path, max_entries, variants, ttl)
+    if backend == 'memory':
+        return ResponseCache(max_entries, variants, ttl)
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -0,0 +1,78 @@
+import logging
+import re
+
+from birth_dates import parse_birth_date
+
+logger = logging.getLogger(__name__)
+
+PAIR_SEPARATOR = re.compile(r'\s+и\s+', re.IGNORECASE)
+
+
+def parse_date(text):
+    """Ответ с одной датой -> (BirthDate,) (None - не дата)"""
+    birth = parse_birth_date(text)
+    if birth is None:
+        return None
+    return (birth,)
+
+
+def parse_pair(text):
+    """Ответ вида "дата и дата" -> (BirthDate, BirthDate) (None - не подходит)"""
+    parts = PAIR_SEPARATOR.split(text)
+    if len(parts) != 2:
+        return None
+    birth1 = parse_birth_date(parts[0])
+    birth2 = parse_birth_date(parts[1])
+    if birth1 is None or birth2 is None:
+        return None
+    return birth1, birth2
+
+
+class Router:
+    """Маршруты команд, callback кнопок и ответов на ожидаемые вопросы
+
+    Все маршруты хранятся в словарях: поиск обработчика не зависит от
+    числа команд. Для ответов в диалоге разбирается только формат,
+    который ждет текущее состояние пользователя. Если ответ не подходит,
+    вызывается invalid(chat_id) состояния, а состояние сохраняется, чтобы
+    пользователь мог ответить еще раз.
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self.callbacks = {}
+        self.states = {}
+
+    def command(self, name, handler):
+        """Команда /name -> handler(chat_id)"""
+        self.commands[name] = handler
+
+    def callback(self, data, handler):
+        """callback_data кнопки -> handler(chat_id)"""
+        self.callbacks[data] = handler
+
+    def state(self, name, parser, handler, invalid=None):
+        """Ответ в состоянии name -> handler(chat_id, *parser(text))"""
+        self.states[name] = (parser, handler, invalid)
+
+    def match_command(self, text):
+        return self.commands.get(text)
+
+    def match_callback(self, data):
+        handler = self.callbacks.get(data)
+        if handler is None:
+            logger.warning(f"Unknown callback data: {data!r}")
+        return handler
+
+    def match_state(self, state, text):
+        """(обработчик, аргументы, состояние завершено) для ответа или None"""
+        route = self.states.get(state)
+        if route is None:
+            return None
+        parser, handler, invalid = route
+        args = parser(text)
+        if args is not None:
+            return handler, args, True
+        if invalid is not None:
+            return invalid, (), False
+        return None
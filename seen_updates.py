@@ -0,0 +1,117 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from sqlite_db import SqliteConnections
+
+
+class SeenUpdates(ABC):
+    """Множество недавно полученных update_id
+
+    Telegram повторяет доставку, если webhook отвечает слишком долго.
+    Повтор с тем же update_id подтверждается без повторной обработки.
+    """
+
+    @abstractmethod
+    def check_and_add(self, update_id):
+        """True, если update_id уже встречался в пределах окна; иначе запоминает его"""
+
+    @abstractmethod
+    def discard(self, update_id):
+        """Забыть update_id (обновление не принято, Telegram пришлет его снова)"""
+
+    @abstractmethod
+    def get_stats(self):
+        pass
+
+
+class MemorySeenUpdates(SeenUpdates):
+    """update_id в памяти процесса за последние window секунд, не больше max_entries"""
+
+    def __init__(self, window=600, max_entries=100000):
+        self.window = window
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.duplicates = 0
+
+    def check_and_add(self, update_id):
+        now = time.time()
+        with self.lock:
+            expires_at = self.entries.get(update_id)
+            if expires_at is not None and expires_at > now:
+                self.duplicates += 1
+                return True
+            self.entries[update_id] = now + self.window
+            self.entries.move_to_end(update_id)
+            # Окно одинаковое для всех, поэтому самые старые записи в начале
+            while self.entries:
+                oldest, expires_at = next(iter(self.entries.items()))
+                if expires_at > now and len(self.entries) <= self.max_entries:
+                    break
+                del self.entries[oldest]
+            return False
+
+    def discard(self, update_id):
+        with self.lock:
+            self.entries.pop(update_id, None)
+
+    def get_stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'duplicates': self.duplicates}
+
+
+class SqliteSeenUpdates(SeenUpdates):
+    """Общее для всех воркеров хоста множество update_id в SQLite (WAL)"""
+
+    def __init__(self, path='state.db', window=600, max_entries=100000, purge_every=1000):
+        self.path = path
+        self.window = window
+        self.max_entries = max_entries
+        self.purge_every = purge_every
+        self.writes = 0
+        self.duplicates = 0
+        self.db = SqliteConnections(path, (
+            'CREATE TABLE IF NOT EXISTS seen_updates ('
+            'update_id INTEGER PRIMARY KEY, expires_at REAL NOT NULL)',
+            'CREATE INDEX IF NOT EXISTS seen_updates_expires ON seen_updates (expires_at)',
+        ))
+
+    def check_and_add(self, update_id):
+        now = time.time()
+        # Одна атомарная операция: вставка новой записи или продление
+        # просроченной. Если строка не изменилась - это повтор.
+        cursor = self.db.get().execute(
+            'INSERT INTO seen_updates (update_id, expires_at) VALUES (?, ?) '
+            'ON CONFLICT (update_id) DO UPDATE SET expires_at = excluded.expires_at '
+            'WHERE seen_updates.expires_at <= ?',
+            (update_id, now + self.window, now)
+        )
+        if cursor.rowcount == 0:
+            self.duplicates += 1
+            return True
+        self.writes += 1
+        if self.writes % self.purge_every == 0:
+            self.purge()
+        return False
+
+    def discard(self, update_id):
+        self.db.get().execute('DELETE FROM seen_updates WHERE update_id = ?', (update_id,))
+
+    def purge(self):
+        """Удаляет просроченные записи и самые старые сверх max_entries"""
+        self.db.purge('seen_updates', 'update_id', self.max_entries)
+
+    def get_stats(self):
+        size = self.db.get().execute('SELECT COUNT(*) FROM seen_updates').fetchone()[0]
+        return {'size': size, 'duplicates': self.duplicates}
+
+
+def create_seen_updates(backend='memory', path='state.db', window=600, max_entries=100000):
+    """Множество update_id по имени бэкенда (тот же, что у хранилища состояния)"""
+    if backend == 'sqlite':
+        return SqliteSeenUpdates(path, window, max_entries)
+    if backend == 'memory':
+        return MemorySeenUpdates(window, max_entries)
+    raise ValueError(f"Unknown state backend: {backend}")
@@ -0,0 +1,194 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class SendDispatcher:
+    """Очередь исходящих сообщений с лимитами Telegram
+
+    Глобальный token bucket (около 30 сообщений в секунду) и отдельный на
+    каждый чат (около 1 в секунду). Сообщения одного чата уходят строго по
+    очереди. При RetryAfter отправка ставится обратно в начало очереди чата,
+    а весь диспетчер ждет указанное Telegram время.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, max_pending=10000,
+                 concurrency=30, max_retries=3):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_pending = max_pending
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.chat_buckets = {}
+        # chat_id -> очередь отправок; чат есть в словаре, пока у него есть
+        # ожидающие или выполняющиеся отправки
+        self.pending = {}
+        # (когда можно отправлять, порядок, chat_id) для чатов, готовых к отправке
+        self.heap = []
+        self.counter = itertools.count()
+        self.paused_until = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.loop = None
+        self.task = None
+        self.slots = None
+        self.wakeup = None
+        self.stats = {
+            'sent': 0,
+            'retried': 0,
+            'failed': 0,
+            'max_depth': 0,
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+            'total_send_time': 0.0,
+        }
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop = loop
+        self.slots = asyncio.Semaphore(self.max_pending)
+        self.wakeup = asyncio.Event()
+        self.task = loop.create_task(self._run())
+
+    async def send(self, chat_id, func):
+        """Ставит отправку в очередь и ждет ее результат
+
+        func - функция без аргументов, возвращающая корутину запроса к Telegram.
+        Если очередь заполнена, ждет освобождения места.
+        """
+        self._ensure_started()
+        await self.slots.acquire()
+        future = self.loop.create_future()
+        job = [func, future, time.monotonic(), 0]
+        self.queued += 1
+        if self.queued > self.stats['max_depth']:
+            self.stats['max_depth'] = self.queued
+        queue = self.pending.get(chat_id)
+        if queue is None:
+            self.pending[chat_id] = deque([job])
+            self._schedule(chat_id, 0)
+        else:
+            queue.append(job)
+        return await future
+
+    def _schedule(self, chat_id, ready_at):
+        heapq.heappush(self.heap, (ready_at, next(self.counter), chat_id))
+        self.wakeup.set()
+
+    async def _wait(self, timeout=None):
+        # asyncio.wait, а не wait_for: wait_for в Python 3.11 может потерять
+        # отмену задачи, если событие сработало одновременно с ней
+        self.wakeup.clear()
+        waiter = asyncio.ensure_future(self.wakeup.wait())
+        try:
+            await asyncio.wait((waiter,), timeout=timeout)
+        finally:
+            waiter.cancel()
+
+    async def _run(self):
+        while True:
+            if not self.heap or self.in_flight >= self.concurrency:
+                await self._wait()
+                continue
+
+            now = time.monotonic()
+            ready_at, _, chat_id = self.heap[0]
+            delay = max(ready_at - now, self.paused_until - now, self.global_bucket.delay(now))
+            if delay > 0:
+                await self._wait(delay)
+                continue
+
+            heapq.heappop(self.heap)
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+            if not bucket.take(now):
+                heapq.heappush(self.heap, (now + bucket.delay(now), next(self.counter), chat_id))
+                continue
+            self.global_bucket.take(now)
+
+            job = self.pending[chat_id].popleft()
+            self.in_flight += 1
+            self.loop.create_task(self._deliver(chat_id, job))
+
+    async def _deliver(self, chat_id, job):
+        func, future, enqueued_at, retries = job
+        ready_at = 0
+        started = time.monotonic()
+        try:
+            result = await func()
+        except RetryAfter as e:
+            retry_after = float(e.retry_after)
+            now = time.monotonic()
+            if retries < self.max_retries:
+                logger.warning(f"Flood control, retrying chat {chat_id} in {retry_after}s")
+                job[3] += 1
+                self.pending[chat_id].appendleft(job)
+                self.paused_until = max(self.paused_until, now + retry_after)
+                ready_at = now + retry_after
+                self.stats['retried'] += 1
+                return
+            self._finish(future, enqueued_at, started, error=e)
+        except Exception as e:
+            self._finish(future, enqueued_at, started, error=e)
+        else:
+            self._finish(future, enqueued_at, started, result=result)
+        finally:
+            self.in_flight -= 1
+            if self.pending[chat_id]:
+                self._schedule(chat_id, ready_at)
+            else:
+                del self.pending[chat_id]
+                self._prune_buckets()
+            self.wakeup.set()
+
+    def _finish(self, future, enqueued_at, started, result=None, error=None):
+        now = time.monotonic()
+        self.queued -= 1
+        self.slots.release()
+        latency = now - enqueued_at
+        self.stats['total_send_time'] += now - started
+        if error is not None:
+            self.stats['failed'] += 1
+            if not future.done():
+                future.set_exception(error)
+            return
+        self.stats['sent'] += 1
+        self.stats['total_latency'] += latency
+        if latency > self.stats['max_latency']:
+            self.stats['max_latency'] = latency
+        if not future.done():
+            future.set_result(result)
+
+    def _prune_buckets(self):
+        # Бакеты чатов с сообщениями в очереди нужны их отправке
+        if len(self.chat_buckets) <= 2 * self.max_pending:
+            return
+        TokenBucket.prune(self.chat_buckets, keep=self.pending)
+
+    def get_stats(self):
+        """Метрики очереди отправки"""
+        stats = dict(self.stats)
+        sent = stats['sent']
+        done = sent + stats['failed']
+        stats['depth'] = self.queued
+        stats['in_flight'] = self.in_flight
+        stats['chats_waiting'] = len(self.pending)
+        total_latency = stats.pop('total_latency')
+        total_send_time = stats.pop('total_send_time')
+        stats['avg_latency_ms'] = round(total_latency / sent * 1000, 2) if sent else 0.0
+        stats['max_latency_ms'] = round(stats.pop('max_latency') * 1000, 2)
+        stats['avg_send_ms'] = round(total_send_time / done * 1000, 2) if done else 0.0
+        return stats
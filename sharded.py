@@ -0,0 +1,361 @@
+"""Многопроцессный запуск: обновления распределяются по процессам по chat_id
+
+Запуск:
+    python sharded.py --shards 4                          # getUpdates
+    python sharded.py --shards 4 --webhook --port 8080    # webhook /<TOKEN>
+
+Все обновления одного чата попадают в один процесс, где живет его
+состояние (достаточно STATE_BACKEND=memory), порядок сообщений
+сохраняется. У каждого процесса свой event loop, клиент Gemini и
+соединения с Bot API. Входной процесс не импортирует bot.py: он только
+читает chat_id из JSON и раскладывает обновления по очередям процессов.
+
+Лимиты на весь бот - SEND_GLOBAL_RATE (общий лимит Telegram),
+GEMINI_MAX_CONCURRENT и GEMINI_MAX_WAITING - задаются на все шарды
+вместе: каждый шард получает долю total/shards.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+from logging_setup import setup_logging
+
+setup_logging(
+    os.getenv('LOG_FORMAT', 'text'),
+    os.getenv('LOG_QUEUE', '0') == '1',
+    os.getenv('LOG_LEVEL', 'INFO'),
+    float(os.getenv('LOG_SAMPLE_RATE', 1))
+)
+logger = logging.getLogger(__name__)
+
+
+def chat_id_of(data):
+    """chat_id из JSON обновления (None, если чата нет)"""
+    for field in ('message', 'edited_message', 'channel_post', 'callback_query'):
+        entry = data.get(field)
+        if entry is None:
+            continue
+        if field == 'callback_query':
+            entry = entry.get('message') or {}
+        chat = entry.get('chat')
+        if chat:
+            return chat['id']
+    return None
+
+
+# Лимиты на весь бот: (переменная, значение по умолчанию в bot.py, тип)
+SHARED_BUDGETS = (
+    ('SEND_GLOBAL_RATE', 30, float),
+    ('GEMINI_MAX_CONCURRENT', 20, int),
+    ('GEMINI_MAX_WAITING', 500, int),
+)
+
+
+def share_budgets(shards):
+    """Делит лимиты на весь бот между шардами; вызывается до import bot"""
+    for name, default, kind in SHARED_BUDGETS:
+        total = kind(os.getenv(name, default))
+        os.environ[name] = str(max(total // shards, 1) if kind is int else total / shards)
+
+
+def run_shard(index, shards, inbox, acks, workers, queue_size):
+    """Процесс шарда: свой импорт бота и свой event loop"""
+    # Остановкой управляет входной процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    share_budgets(shards)
+    import bot as astro
+    from telegram import Update
+    from update_queue import AsyncUpdateWorkerPool
+
+    async def handle(data):
+        try:
+            await astro.process_update(Update.de_json(data, astro.bot))
+        finally:
+            acks.put(index)
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        # Внутри шарда чаты обрабатываются параллельно, каждый - по порядку
+        astro.update_pool = AsyncUpdateWorkerPool(handle, workers, queue_size, name=f'shard-{index}')
+        astro.update_pool.start()
+        while True:
+            data = await loop.run_in_executor(None, inbox.get)
+            if data is None:
+                break
+            # Очередь воркера полна - ждем места, не забирая новые обновления из inbox
+            await astro.update_pool.submit_wait(data, key=chat_id_of(data))
+        await astro.update_pool.stop(astro.SHUTDOWN_DRAIN_TIMEOUT)
+
+    asyncio.run(serve())
+
+
+class ShardRouter:
+    """Очереди и процессы шардов, учет нагрузки по шардам"""
+
+    def __init__(self, shards=4, queue_size=1000, shard_workers=32, stats_interval=60):
+        self.shards = shards
+        self.queue_size = queue_size
+        self.shard_workers = shard_workers
+        self.stats_interval = stats_interval
+        self.context = multiprocessing.get_context('spawn')
+        self.inboxes = [self.context.Queue(queue_size) for _ in range(shards)]
+        self.acks = self.context.Queue()
+        self.processes = [None] * shards
+        self.dispatched = [0] * shards
+        self.processed = [0] * shards
+        self.lost = [0] * shards
+        self.rejected = [0] * shards
+        self.restarts = [0] * shards
+        self.reported = [0] * shards
+        self.idle = threading.Condition()
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for index in range(self.shards):
+            self._start_shard(index)
+        for target in (self._collect_acks, self._report_loop):
+            thread = threading.Thread(target=target, name=target.__name__.strip('_'), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Started {self.shards} shard processes")
+
+    def _start_shard(self, index):
+        process = self.context.Process(
+            target=run_shard, name=f'shard-{index}',
+            args=(index, self.shards, self.inboxes[index], self.acks, self.shard_workers, self.queue_size)
+        )
+        process.start()
+        self.processes[index] = process
+
+    def shard_for(self, data):
+        chat_id = chat_id_of(data)
+        return (chat_id if chat_id is not None else data.get('update_id', 0)) % self.shards
+
+    def dispatch(self, data, block=True):
+        """Передает обновление шарду. False - очередь шарда переполнена"""
+        index = self.shard_for(data)
+        try:
+            self.inboxes[index].put(data, block=block)
+        except queue.Full:
+            with self.idle:
+                self.rejected[index] += 1
+            return False
+        with self.idle:
+            self.dispatched[index] += 1
+        return True
+
+    def wait_idle(self):
+        """Ждет, пока шарды обработают все переданные обновления"""
+        while not self.stopping.is_set():
+            with self.idle:
+                if self.idle.wait_for(lambda: self.processed == self.dispatched, timeout=1):
+                    return
+            self.check_shards()
+
+    def _collect_acks(self):
+        while True:
+            index = self.acks.get()
+            if index is None:
+                return
+            with self.idle:
+                self.processed[index] += 1
+                self.idle.notify_all()
+
+    def check_shards(self):
+        """Перезапускает упавшие процессы шардов"""
+        for index, process in enumerate(self.processes):
+            if self.stopping.is_set() or process.is_alive():
+                continue
+            logger.error(f"Shard {index} exited with code {process.exitcode}, restarting")
+            with self.idle:
+                # То, что процесс успел взять из очереди, потеряно
+                lost = self.dispatched[index] - self.processed[index] - self.inboxes[index].qsize()
+                if lost > 0:
+                    self.lost[index] += lost
+                    self.processed[index] += lost
+                self.restarts[index] += 1
+                self.idle.notify_all()
+            self._start_shard(index)
+
+    def get_stats(self):
+        """Нагрузка по шардам"""
+        with self.idle:
+            return [
+                {
+                    'shard': index,
+                    'pid': self.processes[index].pid,
+                    'alive': self.processes[index].is_alive(),
+                    'dispatched': self.dispatched[index],
+                    'processed': self.processed[index],
+                    'in_flight': self.dispatched[index] - self.processed[index],
+                    'rejected': self.rejected[index],
+                    'lost': self.lost[index],
+                    'restarts': self.restarts[index],
+                }
+                for index in range(self.shards)
+            ]
+
+    def _report_loop(self):
+        while not self.stopping.wait(self.stats_interval):
+            self.check_shards()
+            self.report()
+
+    def report(self):
+        """Пишет в лог нагрузку за интервал и отмечает перегруженные шарды"""
+        stats = self.get_stats()
+        done = [s['processed'] - self.reported[s['shard']] for s in stats]
+        self.reported = [s['processed'] for s in stats]
+        total = sum(done)
+        for s, count in zip(stats, done):
+            # Горячий шард - заметно больше средней доли нагрузки или растущий хвост
+            hot = total and count > 2 * total / self.shards or s['in_flight'] > self.queue_size // 2
+            logger.log(
+                logging.WARNING if hot else logging.INFO,
+                f"Shard {s['shard']}{' HOT' if hot else ''}: {count / self.stats_interval:.1f} updates/s, "
+                f"{s['in_flight']} in flight, {s['rejected']} rejected, {s['restarts']} restarts"
+            )
+
+    def stop(self, timeout=30):
+        """Шарды дорабатывают свои очереди и завершаются"""
+        self.stopping.set()
+        for inbox in self.inboxes:
+            inbox.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"Shard {process.name} not stopped in {timeout}s, terminating")
+                process.terminate()
+        self.acks.put(None)
+        for thread in self.threads:
+            thread.join(1)
+
+
+async def poll(router, stopping, limit=100, timeout=30):
+    """getUpdates во входном процессе, offset сдвигается после обработки пачки шардами"""
+    from telegram import Bot
+    from telegram.error import RetryAfter
+
+    api_url = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+    bot = Bot(token=os.getenv('TELEGRAM_BOT_TOKEN'), base_url=f'{api_url}/bot')
+    await bot.delete_webhook()
+    loop = asyncio.get_running_loop()
+    offset = None
+    backoff = 1
+    stop_wait = asyncio.ensure_future(stopping.wait())
+
+    while not stopping.is_set():
+        fetch = asyncio.ensure_future(bot.get_updates(
+            offset=offset, limit=limit, timeout=timeout, allowed_updates=['message', 'callback_query']
+        ))
+        await asyncio.wait([fetch, stop_wait], return_when=asyncio.FIRST_COMPLETED)
+        if not fetch.done():
+            fetch.cancel()
+            break
+        try:
+            updates = fetch.result()
+            backoff = 1
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except Exception as e:
+            logger.warning(f"getUpdates failed: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        if updates:
+            for update in updates:
+                await loop.run_in_executor(None, router.dispatch, update.to_dict())
+            await loop.run_in_executor(None, router.wait_idle)
+            offset = updates[-1].update_id + 1
+
+    stop_wait.cancel()
+    if offset is not None:
+        try:
+            await bot.get_updates(offset=offset, limit=1, timeout=0)
+        except Exception as e:
+            logger.error(f"Error committing offset {offset}: {e}")
+
+
+def create_app(router):
+    """Webhook входного процесса: разбор chat_id и передача шарду"""
+    from flask import Flask, jsonify, request
+    from seen_updates import MemorySeenUpdates
+
+    app = Flask(__name__)
+    seen = MemorySeenUpdates(int(os.getenv('DEDUP_WINDOW', 600)))
+
+    @app.route(f"/{os.getenv('TELEGRAM_BOT_TOKEN')}", methods=['POST'])
+    def webhook():
+        try:
+            data = json.loads(request.get_data())
+            if seen.check_and_add(data['update_id']):
+                return 'ok'
+            if not router.dispatch(data, block=False):
+                seen.discard(data['update_id'])
+                return 'busy', 503
+        except Exception as e:
+            logger.error(f"Error: {e}")
+        return 'ok'
+
+    @app.route('/health')
+    def health():
+        return 'OK'
+
+    @app.route('/stats')
+    def stats():
+        return jsonify(router.get_stats())
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the bot in several processes sharded by chat_id')
+    parser.add_argument('--shards', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--shard-workers', type=int, default=32, help='chats processed in parallel per shard')
+    parser.add_argument('--queue-size', type=int, default=1000, help='pending updates per shard')
+    parser.add_argument('--stats-interval', type=float, default=60, help='seconds between load reports')
+    parser.add_argument('--webhook', action='store_true', help='receive updates on /<TOKEN> instead of getUpdates')
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8080)))
+    args = parser.parse_args()
+
+    router = ShardRouter(args.shards, args.queue_size, args.shard_workers, args.stats_interval)
+    router.start()
+    try:
+        if args.webhook:
+            import uvicorn
+            # Flask приложение в пуле потоков uvicorn: сервер не форкается,
+            # поэтому очереди и потоки router остаются в этом процессе.
+            # uvicorn сам завершается по SIGINT/SIGTERM, log_config=None
+            # сохраняет настройки setup_logging
+            # Новые версии uvicorn после остановки повторяют пойманный сигнал:
+            # KeyboardInterrupt вместо завершения процесса дает остановить шарды
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            try:
+                uvicorn.run(create_app(router), host='0.0.0.0', port=args.port, interface='wsgi', log_config=None)
+            except KeyboardInterrupt:
+                pass
+        else:
+            async def serve():
+                stopping = asyncio.Event()
+                loop = asyncio.get_running_loop()
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    loop.add_signal_handler(sig, stopping.set)
+                await poll(router, stopping)
+
+            asyncio.run(serve())
+    finally:
+        router.stop()
+        router.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import asyncio
+import threading
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных запросов
+
+    Пока генерация для ключа выполняется, остальные вызовы с тем же ключом
+    ждут ее результат вместо нового запроса. Flask режим выполняет все
+    обработчики в общем event loop (run_sync), поэтому объединение работает
+    и для потоков gunicorn, и для ASGI режима.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.stats = {'leaders': 0, 'coalesced': 0}
+
+    async def do(self, key, func):
+        """Выполняет корутинную функцию func() один раз на ключ"""
+        # Future привязан к своему loop, поэтому ключ включает текущий loop
+        flight_key = (id(asyncio.get_running_loop()), key)
+        with self.lock:
+            task = self.calls.get(flight_key)
+            if task is None:
+                task = asyncio.ensure_future(func())
+                self.calls[flight_key] = task
+                task.add_done_callback(lambda _: self._forget(flight_key, task))
+                self.stats['leaders'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        # shield - отмена одного ожидающего не отменяет запрос для остальных
+        return await asyncio.shield(task)
+
+    def _forget(self, flight_key, task):
+        with self.lock:
+            if self.calls.get(flight_key) is task:
+                del self.calls[flight_key]
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self.calls)
+        return stats
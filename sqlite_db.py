@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+
+class SqliteConnections:
+    """Соединения с файлом SQLite (WAL) для хранилищ бота, одно на поток
+
+    sqlite3.Connection нельзя делить между потоками, поэтому каждый поток
+    (воркеры очереди, потоки gunicorn, to_thread) получает свое. Схема
+    создается на коротком соединении, которое сразу закрывается: при
+    gunicorn --preload кешированное соединение мастера досталось бы
+    воркерам через fork.
+
+    init_pragmas выполняются до включения WAL и создания таблиц (например
+    auto_vacuum), pragmas - при открытии каждого соединения.
+    """
+
+    def __init__(self, path, schema=(), init_pragmas=(), pragmas=(), timeout=5):
+        self.path = path
+        self.pragmas = ('PRAGMA synchronous=NORMAL',) + tuple(pragmas)
+        self.timeout = timeout
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(sqlite3.connect(path, timeout=timeout, isolation_level=None)) as conn:
+            for statement in tuple(init_pragmas) + ('PRAGMA journal_mode=WAL',) + tuple(schema):
+                conn.execute(statement)
+
+    def open(self):
+        """Новое соединение (для фоновых задач со своим соединением)"""
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def get(self):
+        """Соединение текущего потока"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self.open()
+        return conn
+
+    def purge(self, table, key, max_entries, conn=None):
+        """Удаляет просроченные строки (expires_at) и самые старые сверх max_entries
+
+        Возвращает (просрочено, вытеснено).
+        """
+        conn = conn or self.get()
+        expired = conn.execute(f'DELETE FROM {table} WHERE expires_at <= ?', (time.time(),)).rowcount
+        evicted = conn.execute(
+            f'DELETE FROM {table} WHERE {key} IN ('
+            f'SELECT {key} FROM {table} ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+            (max_entries,)
+        ).rowcount
+        return expired, evicted
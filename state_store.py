@@ -0,0 +1,136 @@
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from sqlite_db import SqliteConnections
+
+
+class StateStore(ABC):
+    """Хранилище состояния диалога: какой ответ бот ждет от чата"""
+
+    @abstractmethod
+    def get(self, chat_id):
+        """Ожидаемый ответ (например 'astrology') или None"""
+
+    @abstractmethod
+    def set(self, chat_id, waiting_for):
+        pass
+
+    @abstractmethod
+    def delete(self, chat_id):
+        pass
+
+    @abstractmethod
+    def count_by_state(self):
+        """Число незавершенных диалогов по состояниям"""
+
+
+class MemoryStateStore(StateStore):
+    """Состояние в памяти процесса с TTL и LRU ограничением размера
+
+    Запись - кортеж (истекает, состояние), строки состояний интернируются.
+    """
+
+    def __init__(self, ttl=3600, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, chat_id):
+        with self.lock:
+            entry = self.entries.get(chat_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.entries[chat_id]
+                return None
+            return entry[1]
+
+    def set(self, chat_id, waiting_for):
+        with self.lock:
+            self.entries[chat_id] = (time.time() + self.ttl, sys.intern(waiting_for))
+            self.entries.move_to_end(chat_id)
+            # Самые старые записи в начале - их и вытесняем
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._purge_expired()
+
+    def _purge_expired(self):
+        now = time.time()
+        while self.entries:
+            chat_id, entry = next(iter(self.entries.items()))
+            if entry[0] > now:
+                break
+            del self.entries[chat_id]
+
+    def delete(self, chat_id):
+        with self.lock:
+            self.entries.pop(chat_id, None)
+
+    def count_by_state(self):
+        now = time.time()
+        counts = {}
+        with self.lock:
+            for expires_at, waiting_for in self.entries.values():
+                if expires_at > now:
+                    counts[waiting_for] = counts.get(waiting_for, 0) + 1
+        return counts
+
+
+class SqliteStateStore(StateStore):
+    """Общее для всех воркеров хоста состояние в SQLite (WAL)"""
+
+    def __init__(self, path='state.db', ttl=3600, max_entries=100000, purge_every=1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.purge_every = purge_every
+        self.writes = 0
+        self.db = SqliteConnections(path, (
+            'CREATE TABLE IF NOT EXISTS chat_state ('
+            'chat_id INTEGER PRIMARY KEY, waiting_for TEXT NOT NULL, expires_at REAL NOT NULL)',
+            'CREATE INDEX IF NOT EXISTS chat_state_expires ON chat_state (expires_at)',
+        ))
+
+    def get(self, chat_id):
+        row = self.db.get().execute(
+            'SELECT waiting_for FROM chat_state WHERE chat_id = ? AND expires_at > ?',
+            (chat_id, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, chat_id, waiting_for):
+        conn = self.db.get()
+        conn.execute(
+            'INSERT OR REPLACE INTO chat_state (chat_id, waiting_for, expires_at) VALUES (?, ?, ?)',
+            (chat_id, waiting_for, time.time() + self.ttl)
+        )
+        self.writes += 1
+        if self.writes % self.purge_every == 0:
+            self.purge()
+
+    def delete(self, chat_id):
+        self.db.get().execute('DELETE FROM chat_state WHERE chat_id = ?', (chat_id,))
+
+    def purge(self):
+        """Удаляет просроченные записи и самые старые сверх max_entries"""
+        self.db.purge('chat_state', 'chat_id', self.max_entries)
+
+    def count_by_state(self):
+        rows = self.db.get().execute(
+            'SELECT waiting_for, COUNT(*) FROM chat_state WHERE expires_at > ? GROUP BY waiting_for',
+            (time.time(),)
+        ).fetchall()
+        return dict(rows)
+
+
+def create_state_store(backend='memory', path='state.db', ttl=3600, max_entries=100000):
+    """Хранилище состояния по имени бэкенда: memory или sqlite"""
+    if backend == 'sqlite':
+        return SqliteStateStore(path, ttl, max_entries)
+    if backend == 'memory':
+        return MemoryStateStore(ttl, max_entries)
+    raise ValueError(f"Unknown state backend: {backend}")
@@ -0,0 +1,60 @@
+import time
+
+from sqlite_db import SqliteConnections
+
+
+class SubscriberStore:
+    """Пользователи, указавшие дату рождения, и прогресс рассылок (SQLite)"""
+
+    def __init__(self, path='subscribers.db'):
+        self.path = path
+        self.db = SqliteConnections(path, (
+            'CREATE TABLE IF NOT EXISTS subscribers ('
+            'chat_id INTEGER PRIMARY KEY, sign TEXT NOT NULL, birth_date TEXT NOT NULL, '
+            'updated_at REAL NOT NULL)',
+            'CREATE TABLE IF NOT EXISTS broadcast_runs ('
+            'run_id TEXT PRIMARY KEY, last_chat_id INTEGER NOT NULL, sent INTEGER NOT NULL, '
+            'failed INTEGER NOT NULL, started_at REAL NOT NULL, finished_at REAL)',
+        ))
+
+    def add(self, chat_id, sign, birth_date):
+        """Запоминает знак пользователя (повторный вызов обновляет запись)"""
+        self.db.get().execute(
+            'INSERT OR REPLACE INTO subscribers (chat_id, sign, birth_date, updated_at) VALUES (?, ?, ?, ?)',
+            (chat_id, sign, birth_date, time.time())
+        )
+
+    def remove(self, chat_id):
+        self.db.get().execute('DELETE FROM subscribers WHERE chat_id = ?', (chat_id,))
+
+    def count(self):
+        return self.db.get().execute('SELECT COUNT(*) FROM subscribers').fetchone()[0]
+
+    def iter_chunks(self, after_chat_id=0, chunk_size=1000):
+        """Подписчики пачками [(chat_id, sign)] по возрастанию chat_id"""
+        conn = self.db.get()
+        while True:
+            rows = conn.execute(
+                'SELECT chat_id, sign FROM subscribers WHERE chat_id > ? ORDER BY chat_id LIMIT ?',
+                (after_chat_id, chunk_size)
+            ).fetchall()
+            if not rows:
+                return
+            yield rows
+            after_chat_id = rows[-1][0]
+
+    def load_run(self, run_id):
+        """Прогресс рассылки: (last_chat_id, sent, failed, finished_at) или None"""
+        return self.db.get().execute(
+            'SELECT last_chat_id, sent, failed, finished_at FROM broadcast_runs WHERE run_id = ?',
+            (run_id,)
+        ).fetchone()
+
+    def save_run(self, run_id, last_chat_id, sent, failed, finished=False):
+        self.db.get().execute(
+            'INSERT INTO broadcast_runs (run_id, last_chat_id, sent, failed, started_at, finished_at) '
+            'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(run_id) DO UPDATE SET '
+            'last_chat_id = excluded.last_chat_id, sent = excluded.sent, failed = excluded.failed, '
+            'finished_at = excluded.finished_at',
+            (run_id, last_chat_id, sent, failed, time.time(), time.time() if finished else None)
+        )
@@ -0,0 +1,47 @@
+import httpx
+from telegram.request import HTTPXRequest
+
+# http2 -> ssl.SSLContext (для HTTP/2 в ALPN добавлен h2)
+ssl_contexts = {}
+
+
+class TunedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest с настраиваемым временем жизни keep-alive соединений
+
+    HTTP/2 (http_version='2') требует установленного пакета httpx[http2].
+    """
+
+    def __init__(self, keepalive_expiry=30.0, **kwargs):
+        self.keepalive_expiry = keepalive_expiry
+        super().__init__(**kwargs)
+
+    def _build_client(self):
+        # HTTPXRequest не принимает keepalive_expiry, поэтому подменяем
+        # лимиты перед созданием клиента
+        limits = self._client_kwargs['limits']
+        self._client_kwargs['limits'] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        # Загрузка сертификатов в SSL контекст занимает ~20 мс на клиент,
+        # поэтому все пулы процесса используют общий контекст
+        http2 = not self._client_kwargs['http1']
+        if http2 not in ssl_contexts:
+            ssl_contexts[http2] = httpx.create_ssl_context(http2=http2)
+        self._client_kwargs['verify'] = ssl_contexts[http2]
+        return super()._build_client()
+
+
+def create_request(pool_size=32, keepalive_expiry=30.0, http_version='1.1',
+                   connect_timeout=5.0, read_timeout=5.0, write_timeout=5.0, pool_timeout=5.0):
+    """Пул соединений к Bot API"""
+    return TunedHTTPXRequest(
+        keepalive_expiry=keepalive_expiry,
+        connection_pool_size=pool_size,
+        http_version=http_version,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        write_timeout=write_timeout,
+        pool_timeout=pool_timeout,
+    )
@@ -0,0 +1,137 @@
+"""Обрезка AI текста по границам предложений
+
+Граница предложения - знаки . ! ? … (с закрывающими кавычками и скобками)
+вместе с идущими следом эмодзи, за которыми пробел или конец текста:
+"Звезды на вашей стороне! ✨ Используйте..." режется после ✨. Точка
+внутри числа (3.5) границей не считается. Обрезка готового текста
+просматривает каждый символ не больше одного раза; потоковая на каждом
+фрагменте перечитывает только незаконченное предложение.
+"""
+import re
+import unicodedata
+
+# Символы эмодзи, модификаторы и соединители, которые продолжают эмодзи
+EMOJI = (
+    r'\u00a9\u00ae\u203c\u2049\u2122\u2139\u2190-\u21ff\u2300-\u23ff\u2460-\u24ff'
+    r'\u25a0-\u27bf\u2900-\u297f\u2b00-\u2bff\u3030\u303d\u3297\u3299'
+    r'\U0001f000-\U0001faff\ufe0f\u200d\u20e3'
+)
+TERMINATORS = '.!?…'
+SENTENCE_END = re.compile(rf'[{TERMINATORS}]+[»"”\')\]]*(?:[ \t]*[{EMOJI}]+)*(?=\s|\Z)')
+
+# Конец буфера после границы: следом еще могут прийти эмодзи
+OPEN_END = re.compile(r'[ \t]*\Z')
+WORD = re.compile(r'\w')
+
+ZWJ = '\u200d'
+
+
+def is_regional_indicator(char):
+    return '\U0001f1e6' <= char <= '\U0001f1ff'
+
+
+def continues_cluster(text, index):
+    """True, если символ text[index] - продолжение символа перед ним"""
+    char = text[index]
+    previous = text[index - 1]
+    if char == ZWJ or previous == ZWJ:
+        return True
+    if unicodedata.category(char) in ('Mn', 'Me') or '\U0001f3fb' <= char <= '\U0001f3ff':
+        # Вариационные селекторы, комбинирующие знаки, цвет кожи
+        return True
+    if '\U000e0020' <= char <= '\U000e007f':
+        # Теги флагов регионов
+        return True
+    if is_regional_indicator(char) and is_regional_indicator(previous):
+        # Флаг - пара региональных индикаторов: считаем, четный ли это символ пары
+        start = index
+        while start > 0 and is_regional_indicator(text[start - 1]):
+            start -= 1
+        return (index - start) % 2 == 1
+    return False
+
+
+def hard_cut(text, max_length):
+    """Обрезка по длине без разрыва составных эмодзи и букв с диакритикой"""
+    if len(text) <= max_length:
+        return text
+    cut = max_length
+    while cut > 0 and continues_cluster(text, cut):
+        cut -= 1
+    return text[:cut].rstrip()
+
+
+class SentenceTruncator:
+    """Инкрементальная обрезка: текст подается фрагментами по мере генерации
+
+    feed() возвращает законченные предложения, уже укладывающиеся в
+    max_length. Когда текст длиннее лимита (full), дальнейшие фрагменты
+    результат не меняют.
+    """
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self.text = ''
+        self.cut = 0
+        self.scan_from = 0
+        self.full = False
+
+    def feed(self, chunk):
+        """Добавляет фрагмент и возвращает текущую видимую часть"""
+        if not self.full:
+            self.text += chunk
+            self._scan(final=False)
+        return self.text[:self.cut].strip()
+
+    def _scan(self, final):
+        for match in SENTENCE_END.finditer(self.text, self.scan_from):
+            end = match.end()
+            if end > self.max_length:
+                self.full = True
+                return
+            if not final and OPEN_END.match(self.text, end):
+                # Следующий фрагмент может продолжить знаки или эмодзи
+                break
+            self.cut = end
+            self.scan_from = end
+        # Буква или цифра за лимитом: все границы до лимита уже определены
+        if len(self.text) > self.max_length and WORD.search(self.text, self.max_length):
+            self.full = True
+
+    def result(self):
+        """Итоговый текст: весь, если укладывается, иначе по последней границе"""
+        self._scan(final=True)
+        if len(self.text) <= self.max_length:
+            return self.text
+        if self.cut:
+            return self.text[:self.cut].strip()
+        return hard_cut(self.text, self.max_length)
+
+
+def last_boundary(text, max_length):
+    """Конец последнего предложения, укладывающегося в max_length (0 - нет)
+
+    Знаки конца предложения ищутся с лимита назад через str.rfind, каждый
+    кандидат проверяется SENTENCE_END. Поиск для каждого знака продолжается
+    с прошлой позиции, так что текст просматривается один раз.
+    """
+    found = {char: text.rfind(char, 0, max_length) for char in TERMINATORS}
+    while True:
+        pos = max(found.values())
+        if pos < 0:
+            return 0
+        match = SENTENCE_END.match(text, pos)
+        if match and match.end() <= max_length:
+            return match.end()
+        char = text[pos]
+        found[char] = text.rfind(char, 0, pos)
+
+
+def truncate(text, max_length):
+    """Обрезает текст по последнему предложению, укладывающемуся в max_length"""
+    if len(text) <= max_length:
+        return text
+    cut = last_boundary(text, max_length)
+    if cut:
+        return text[:cut].strip()
+    return hard_cut(text, max_length)
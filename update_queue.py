@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateWorkerPool:
+    """Ограниченная очередь входящих обновлений с пулом фоновых воркеров
+
+    У каждого воркера своя очередь, обновления одного чата всегда попадают
+    к одному воркеру - так сохраняется порядок сообщений в диалоге.
+    """
+
+    def __init__(self, handler, workers=4, maxsize=1000, name='update-worker'):
+        self.handler = handler
+        self.workers = workers
+        self.name = name
+        self.maxsize = maxsize
+        self.queues = [queue.Queue(maxsize=max(maxsize // workers, 1)) for _ in range(workers)]
+        self.next_queue = 0
+        self.threads = []
+        self.stopping = False
+        self.lock = threading.Lock()
+        self.stats = {
+            'enqueued': 0,
+            'processed': 0,
+            'rejected': 0,
+            'errors': 0,
+            'max_depth': 0,
+            'busy_workers': 0,
+            'total_wait': 0.0,
+        }
+
+    def start(self):
+        """Запуск воркеров"""
+        for i, q in enumerate(self.queues):
+            thread = threading.Thread(target=self._run, args=(q,), name=f'{self.name}-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Started {self.workers} update workers (queue size {self.maxsize})")
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def _queue_index(self, key):
+        # Обновления одного чата - в одну очередь, без ключа - по кругу
+        if key is not None:
+            return hash(key) % self.workers
+        # submit вызывают потоки gunicorn одновременно
+        with self.lock:
+            index = self.next_queue
+            self.next_queue = (index + 1) % self.workers
+        return index
+
+    def submit(self, item, key=None):
+        """Кладет обновление в очередь, не блокируясь. False - очередь переполнена"""
+        if self.stopping:
+            return False
+        try:
+            self.queues[self._queue_index(key)].put_nowait((time.monotonic(), item))
+        except (queue.Full, asyncio.QueueFull):
+            with self.lock:
+                self.stats['rejected'] += 1
+            return False
+        with self.lock:
+            self.stats['enqueued'] += 1
+            depth = self.depth()
+            if depth > self.stats['max_depth']:
+                self.stats['max_depth'] = depth
+        return True
+
+    def _run(self, q):
+        while True:
+            entry = q.get()
+            if entry is None:
+                q.task_done()
+                return
+            enqueued_at, item = entry
+            with self.lock:
+                self.stats['busy_workers'] += 1
+                self.stats['total_wait'] += time.monotonic() - enqueued_at
+            try:
+                self.handler(item)
+            except Exception as e:
+                logger.error(f"Worker error: {e}")
+                with self.lock:
+                    self.stats['errors'] += 1
+            finally:
+                with self.lock:
+                    self.stats['busy_workers'] -= 1
+                    self.stats['processed'] += 1
+                q.task_done()
+
+    def get_stats(self):
+        """Метрики очереди для мониторинга"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats['depth'] = self.depth()
+        stats['capacity'] = self.maxsize
+        stats['workers'] = self.workers
+        total_wait = stats.pop('total_wait')
+        stats['avg_wait_ms'] = round(total_wait / stats['processed'] * 1000, 2) if stats['processed'] else 0.0
+        return stats
+
+    def stop(self, timeout=30):
+        """Дожидается обработки очереди и останавливает воркеров"""
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info(f"Draining update queue ({self.depth()} pending)")
+        deadline = time.monotonic() + timeout
+        for q in self.queues:
+            # Маркер остановки встает в конец очереди, поэтому все, что уже
+            # принято, будет обработано
+            while True:
+                try:
+                    q.put(None, timeout=max(deadline - time.monotonic(), 0.01))
+                    break
+                except queue.Full:
+                    if time.monotonic() >= deadline:
+                        break
+        for thread in self.threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        alive = sum(1 for thread in self.threads if thread.is_alive())
+        if alive:
+            logger.warning(f"Update queue not drained in {timeout}s, {self.depth()} left")
+
+
+class AsyncUpdateWorkerPool(UpdateWorkerPool):
+    """Та же очередь для ASGI режима: воркеры - задачи в event loop сервера"""
+
+    def __init__(self, handler, workers=4, maxsize=1000, name='update-worker'):
+        super().__init__(handler, workers, maxsize, name)
+        self.queues = [asyncio.Queue(maxsize=max(maxsize // workers, 1)) for _ in range(workers)]
+        self.tasks = []
+
+    def start(self):
+        """Запуск воркеров в текущем event loop"""
+        for i, q in enumerate(self.queues):
+            self.tasks.append(asyncio.create_task(self._run(q), name=f'{self.name}-{i}'))
+        logger.info(f"Started {self.workers} async update workers (queue size {self.maxsize})")
+
+    async def submit_wait(self, item, key=None):
+        """Кладет обновление в очередь, дожидаясь места в ней. False - пул остановлен"""
+        if self.stopping:
+            return False
+        await self.queues[self._queue_index(key)].put((time.monotonic(), item))
+        with self.lock:
+            self.stats['enqueued'] += 1
+            depth = self.depth()
+            if depth > self.stats['max_depth']:
+                self.stats['max_depth'] = depth
+        return True
+
+    async def _run(self, q):
+        while True:
+            entry = await q.get()
+            if entry is None:
+                q.task_done()
+                return
+            enqueued_at, item = entry
+            with self.lock:
+                self.stats['busy_workers'] += 1
+                self.stats['total_wait'] += time.monotonic() - enqueued_at
+            try:
+                await self.handler(item)
+            except Exception as e:
+                logger.error(f"Worker error: {e}")
+                with self.lock:
+                    self.stats['errors'] += 1
+            finally:
+                with self.lock:
+                    self.stats['busy_workers'] -= 1
+                    self.stats['processed'] += 1
+                q.task_done()
+
+    async def stop(self, timeout=30):
+        """Дожидается обработки очереди и останавливает воркеров"""
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info(f"Draining update queue ({self.depth()} pending)")
+        try:
+            async with asyncio.timeout(timeout):
+                for q in self.queues:
+                    await q.put(None)
+                await asyncio.gather(*self.tasks)
+        except TimeoutError:
+            logger.warning(f"Update queue not drained in {timeout}s, {self.depth()} left")
+            for task in self.tasks:
+                task.cancel()